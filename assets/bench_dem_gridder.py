@@ -0,0 +1,71 @@
+"""compares the PDAL writers.gdal DEM pipeline with the NumPy mean-Z gridder
+
+usage: python assets/bench_dem_gridder.py <config_json> <las> [<las> ...]
+(the PDAL grid starts at the filtered points' extents and the NumPy grid at
+the header's, so the cell values are compared where the grids line up; PDAL
+also averages the points within resolution * sqrt(2) of each cell center,
+rather than those in the cell, so the values differ a little)
+"""
+
+import sys
+import time
+from pathlib import Path
+import numpy as np
+import rasterio
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from qchecker import Configuration, LasTile, Surface, MeanZGridAccumulator
+
+
+def pdal_dem(las_path, config):
+    tile = LasTile(las_path, config, header_only=True)
+    surface = Surface(tile, 'DEM', config)
+    surface.gen_mean_z_surface('mean')
+    with rasterio.open(surface.path) as src:
+        return src.profile, src.read(1)
+
+
+def numpy_dem(las_path, config):
+    tile = LasTile(las_path, config)
+    gridder = MeanZGridAccumulator(tile)
+    for points in tile.iter_points(gridder.fields):
+        gridder.update(points)
+    gridder.finalize(tile)
+    profile, data = tile.surface_rasters['DEM']
+    return profile, data[0]
+
+
+def compare(pdal_result, numpy_result):
+    (pdal_profile, pdal_data), (numpy_profile, numpy_data) = pdal_result, numpy_result
+    res = numpy_profile['transform'].a
+    col_off = int(round((pdal_profile['transform'].c - numpy_profile['transform'].c) / res))
+    row_off = int(round((numpy_profile['transform'].f - pdal_profile['transform'].f) / res))
+    rows = min(pdal_data.shape[0], numpy_data.shape[0] - row_off)
+    cols = min(pdal_data.shape[1], numpy_data.shape[1] - col_off)
+    a = pdal_data[:rows, :cols]
+    b = numpy_data[row_off:row_off + rows, col_off:col_off + cols]
+    valid = (a != pdal_profile['nodata']) & (b != numpy_profile['nodata'])
+    max_diff = np.abs(a[valid] - b[valid]).max() if valid.any() else 0
+    return int((a != pdal_profile['nodata']).sum()), int((b != numpy_profile['nodata']).sum()), max_diff
+
+
+def time_it(func, *args, repeats=3):
+    times = []
+    for _ in range(repeats):
+        tic = time.perf_counter()
+        result = func(*args)
+        times.append(time.perf_counter() - tic)
+    return min(times), result
+
+
+if __name__ == '__main__':
+    config = Configuration(sys.argv[1])
+    for las_path in sys.argv[2:]:
+        tile = LasTile(las_path, config, header_only=True)
+        pdal_time, pdal_result = time_it(pdal_dem, las_path, config)
+        numpy_time, numpy_result = time_it(numpy_dem, las_path, config)
+        pdal_cells, numpy_cells, max_diff = compare(pdal_result, numpy_result)
+        print(f'{tile.name} ({tile.las_header.num_points} pts): '
+              f'PDAL {pdal_time:.3f} s, NumPy {numpy_time:.3f} s, '
+              f'{pdal_time / numpy_time:.1f}x, cells with data: {pdal_cells} (PDAL), '
+              f'{numpy_cells} (NumPy), max difference {max_diff:.3f}')
@@ -0,0 +1,56 @@
+"""compares laspy 1.x File reads with the LasTile memmap for the point-level checks
+
+usage: python assets/bench_point_access.py <config_json> <las> [<las> ...]
+(e.g., one tile each of PDRF 1, 3 and 6)
+"""
+
+import sys
+import time
+from pathlib import Path
+import numpy as np
+from laspy.file import File
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from qchecker import Configuration, LasTile
+
+
+def laspy_file(las_path):
+    in_file = File(las_path, mode='r')
+    points = in_file.points['point']
+    class_key = 'classification_byte' if in_file.header.data_format_id >= 6 else 'raw_classification'
+    class_counts = np.bincount(points[class_key], minlength=256)
+    pt_src_ids = np.unique(in_file.pt_src_id)
+    in_file.close()
+    return class_counts, pt_src_ids
+
+
+def las_tile_memmap(las_path, config):
+    tile = LasTile(las_path, config)
+    class_key = tile.las_header.get_class_field()
+    class_counts = np.zeros(256, dtype=np.int64)
+    pt_src_ids = np.zeros(65536, dtype=np.int64)
+    for points in tile.iter_points([class_key, 'pt_src_id']):
+        class_counts += np.bincount(points[class_key], minlength=256)
+        pt_src_ids += np.bincount(points['pt_src_id'], minlength=65536)
+    return class_counts, np.where(pt_src_ids > 0)[0]
+
+
+def time_it(func, *args, repeats=3):
+    times = []
+    for _ in range(repeats):
+        tic = time.perf_counter()
+        result = func(*args)
+        times.append(time.perf_counter() - tic)
+    return min(times), result
+
+
+if __name__ == '__main__':
+    config = Configuration(sys.argv[1])
+    for las_path in sys.argv[2:]:
+        tile = LasTile(las_path, config, header_only=True)
+        laspy_time, laspy_result = time_it(laspy_file, las_path)
+        memmap_time, memmap_result = time_it(las_tile_memmap, las_path, config)
+        same = all(np.array_equal(a, b) for a, b in zip(laspy_result, memmap_result))
+        print(f'{tile.name} (PDRF {tile.get_las_pdrf()}, {tile.las_header.num_points} pts): '
+              f'laspy {laspy_time:.3f} s, memmap {memmap_time:.3f} s, '
+              f'{laspy_time / memmap_time:.1f}x, same results: {same}')
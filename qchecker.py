@@ -1,5 +1,14 @@
 import os
 import json
+import struct
+import hashlib
+import sqlite3
+import heapq
+import queue
+import threading
+import itertools
+import shutil
+import socket
 import logging
 import numpy as np
 import pandas as pd
@@ -8,20 +17,24 @@ from shapely.geometry import Point, Polygon
 from shapely import wkt
 import subprocess
 from functools import partial
-from laspy.file import File
+from contextlib import contextmanager
+from collections import namedtuple, defaultdict
 
 import pdal
 import multiprocessing as mp
 
 import re
+import fnmatch
 import ast
 import time
 from osgeo import osr
 from pathlib import Path
 from tqdm import tqdm
 import rasterio
-import rasterio.merge
-from rasterio.io import MemoryFile
+import rasterio.transform
+import rasterio.shutil
+from rasterio.enums import Resampling
+from rasterio.windows import Window
 
 from bokeh.models.widgets import Panel, Tabs
 from bokeh.io import output_file, show
@@ -397,14 +410,26 @@ class Configuration:
         with open(config) as f:
             data = json.load(f)
 
+        self.config_json = config
         self.data = data
         self.project_dir = Path(data['project_dir'])
         self.project_name = self.project_dir.name
         self.las_tile_dir = Path(data['las_tile_dir'])
+        self.las_patterns = data.get('las_patterns', ['*.las', '*.LAS', '*.laz'])
+        self.watch_interval = float(data.get('watch_interval', 60))
+        self.watch_settle_time = float(data.get('watch_settle_time', 120))
         self.qaqc_dir = Path(data['qaqc_dir'])
         self.tile_size = float(data['tile_size'])
         self.to_pyramid = data['to_pyramid']
         self.multiprocess = data['multiprocess']
+        self.num_workers = int(data.get('num_workers') or max(int(mp.cpu_count() / 2), 1))
+        self.chunksize = int(data.get('chunksize', 1))
+        self.maxtasksperchild = data.get('maxtasksperchild')
+        self.ram_budget_gb = data.get('ram_budget_gb')
+        self.distributed = data.get('distributed', False)
+        self.queue_poll_interval = float(data.get('queue_poll_interval', 1.0))
+        self.task_timeout = data.get('task_timeout', 3600)  # seconds per tile, null to wait forever
+        self.max_retries = int(data.get('max_retries', 1))
         self.projects_unc = data['projects_unc']
         self.check_keys = data['check_keys']
         self.hdatum_key = data['check_keys']['hdatum']
@@ -415,53 +440,496 @@ class Configuration:
         self.version_key = data['check_keys']['version']
         self.pt_src_ids_key = data['check_keys']['pt_src_ids']
         self.las_classes_json = Path(data['las_classes_json'])
+        self.point_chunk_size = int(data.get('point_chunk_size', 1000000))
+        self.point_stats = data.get('point_stats', False)
+        self.results_batch_size = int(data.get('results_batch_size', 500))
         self.srs_wkts = Path(data['srs_wkts'])
-        self.wkts_df = pd.read_csv(self.srs_wkts, index_col=1, header=None)
-        self.epsg_code = int(self.wkts_df.loc[self.hdatum_key][0])
+        wkts_df = pd.read_csv(self.srs_wkts, index_col=1, header=None)
+        self.epsg_code = int(wkts_df.loc[self.hdatum_key][0])
         self.crs = {'init': 'epsg:{}'.format(self.epsg_code)}
         self.web_mercator_epsg = {'init': 'epsg:3857'}
         self.wgs84_epsg = {'init': 'epsg:4326'}
         self.checks_to_do = data['checks_to_do']
         self.surfaces_to_make = data['surfaces_to_make']
+        self.surface_resolution = float(data.get('surface_resolution', 1.0))
+        self.surface_outputs = self.get_surface_outputs()
+        self.snap_to_tile_grid = data.get('snap_to_tile_grid', False)
+        self.surface_engine = data.get('surface_engine', 'numpy')  # or 'pdal'
         self.qaqc_geojson_NAD83_UTM_CENTROIDS = self.qaqc_dir / 'qaqc_NAD83_UTM_CENTROIDS.json'
         self.qaqc_geojson_NAD83_UTM_POLYGONS = self.qaqc_dir / 'qaqc_NAD83_UTM_POLYGONS.json'
         self.qaqc_geojson_WebMercator_CENTROIDS = self.qaqc_dir / 'dashboard' / '{}_qaqc_WebMercator_CENTROIDS.json'.format(self.project_name)
         self.qaqc_geojson_WebMercator_POLYGONS = self.qaqc_dir / 'dashboard' / '{}_qaqc_WebMercator_POLYGONS.json'.format(self.project_name)
         self.qaqc_shp_NAD83_UTM_POLYGONS = self.qaqc_dir / 'tile_results' / '{}_qaqc_NAD83_UTM.shp'.format(self.project_name)
-        self.json_dir = self.qaqc_dir / 'tile_results' / 'json'
+        self.tile_results_dir = self.qaqc_dir / 'tile_results'
+        self.work_queue_dir = self.qaqc_dir / 'work_queue'
+        self.run_journal = self.tile_results_dir / '{}_run_journal.jsonl'.format(self.project_name)
+        self.results_db = self.tile_results_dir / '{}_qaqc_results.sqlite'.format(self.project_name)
+        self.quarantine_json = self.tile_results_dir / '{}_quarantine.json'.format(self.project_name)
+        self.watch_state_json = self.tile_results_dir / '{}_watch_state.json'.format(self.project_name)
+        self.watch_journal = self.tile_results_dir / '{}_watch_journal.jsonl'.format(self.project_name)
 
-        if not self.json_dir.exists():
-            os.makedirs(self.json_dir)
+        if not self.tile_results_dir.exists():
+            os.makedirs(self.tile_results_dir)
+
+        self.force_rerun = data.get('force_rerun', False)
+
+        if data.get('cache_srs', False):
+            self.srs_cache_json = self.qaqc_dir / 'srs_cache.json'
+        else:
+            self.srs_cache_json = None
 
         self.tile_geojson_WebMercator_POLYGONS = self.qaqc_dir / 'tiles_WebMercator_POLYGONS.json'
         self.tile_shp_NAD83_UTM_CENTROIDS = self.qaqc_dir / 'tiles_centroids_NAD83_UTM.shp'
         #self.epsg_json = Path(data['epsg_json'])
 
+    def get_surface_outputs(self):
+        # a surface's resolution (or list of resolutions) is the optional
+        # third item in surfaces_to_make; the finest is named for the surface
+        # (e.g., DEM) and each coarser one for its resolution too (e.g.,
+        # DEM_10), which is aggregated from the finest grid
+        surface_outputs = {}
+        for stype, settings in self.surfaces_to_make.items():
+            resolutions = settings[2] if len(settings) > 2 else None
+            if resolutions is None:
+                resolutions = self.surface_resolution
+            if not isinstance(resolutions, list):
+                resolutions = [resolutions]
+            resolutions = sorted(set(float(r) for r in resolutions))
+
+            surface_outputs[stype] = (stype, resolutions[0])
+            for resolution in resolutions[1:]:
+                factor = resolution / resolutions[0]
+                if not np.isclose(factor, round(factor)):
+                    raise ValueError(f'{stype} resolution {resolution} is not a multiple of {resolutions[0]}')
+                surface_outputs[f'{stype}_{resolution:g}'] = (stype, resolution)
+        return surface_outputs
+
     def __str__(self):
         return json.dumps(self.data, indent=4, sort_keys=True)
 
         
+LasTileEntry = namedtuple('LasTileEntry', 'path size mtime_ns')
+
+
 class LasTileCollection():
 
-    def __init__(self, las_tile_dir):
+    def __init__(self, las_tile_dir, las_patterns=('*.las', '*.LAS', '*.laz')):
         self.las_tile_dir = las_tile_dir
-        self.num_las = len(self.get_las_names())
+        self.las_patterns = las_patterns
+
+    @property
+    def num_las(self):
+        return sum(1 for _ in self.iter_las_tiles())
+
+    def is_las(self, name):
+        return any(fnmatch.fnmatchcase(name, p) for p in self.las_patterns)
+
+    def iter_las_tiles(self):
+        # one scandir per directory gives the names and sizes together (on 
+        # Windows, stat() on the dirent doesn't go back to the share), and 
+        # tiles are yielded as they're found so processing can start 
+        # before a slow share has been listed in full
+        dirs = [str(self.las_tile_dir)]
+        while dirs:
+            d = dirs.pop()
+            try:
+                entries = os.scandir(d)
+            except OSError as e:
+                logging.warning(e)
+                continue
+            with entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir():
+                            dirs.append(entry.path)
+                        elif entry.is_file() and self.is_las(entry.name):
+                            stat = entry.stat()
+                            yield LasTileEntry(entry.path, stat.st_size, stat.st_mtime_ns)
+                    except OSError as e:
+                        logging.warning(e)
 
     def get_las_tile_paths(self):
-        return [os.path.join(self.las_tile_dir, f) 
-          for f in os.listdir(self.las_tile_dir) 
-          if f.endswith('.las')]
+        return [t.path for t in self.iter_las_tiles()]
 
     def get_las_names(self):
-        return [f for f in os.listdir(self.las_tile_dir) if f.endswith('.las')]
+        return [os.path.basename(t.path) for t in self.iter_las_tiles()]
 
     def get_las_base_names(self):
         return [os.path.splitext(tile)[0] for tile in self.get_las_names()]
 
 
+class TileWatcher:
+
+    # polls las_tile_dir for new or changed tiles, and hands them over once 
+    # their size and mtime have held still for watch_settle_time seconds, 
+    # i.e., once they've finished uploading
+
+    def __init__(self, config):
+        self.config = config
+        self.las_tile_collection = LasTileCollection(self.config.las_tile_dir, self.config.las_patterns)
+        self.state_json = self.config.watch_state_json
+        self.settling = {}  # las_path: [(size, mtime_ns), when it was first seen that way]
+        self.seen = {}  # las_path: [size, mtime_ns] when it was handed over
+        if self.state_json.exists():
+            with open(self.state_json) as f:
+                self.seen = json.load(f)
+
+    def poll(self):
+        now = time.time()
+        stable = []
+        for las_tile in self.las_tile_collection.iter_las_tiles():
+            state = [las_tile.size, las_tile.mtime_ns]
+            if self.seen.get(las_tile.path) == state:
+                continue
+            settling = self.settling.get(las_tile.path)
+            if settling is None or settling[0] != state:
+                self.settling[las_tile.path] = [state, now]
+            elif now - settling[1] >= self.config.watch_settle_time:
+                del self.settling[las_tile.path]
+                stable.append(las_tile)
+        return stable
+
+    def add_seen(self, las_tiles):
+        for las_tile in las_tiles:
+            self.seen[las_tile.path] = [las_tile.size, las_tile.mtime_ns]
+        tmp_path = self.state_json.with_name(self.state_json.name + '.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(self.seen, f)
+        os.replace(tmp_path, self.state_json)
+
+
+LasVlr = namedtuple('LasVlr', 'user_id record_id description body')
+
+
+class LasHeader:
+
+    # public header block (LAS 1.0 - 1.2), in file order
+    public_header_fields = [
+        ('file_signature', '4s'),
+        ('file_source_id', 'H'),
+        ('global_encoding', 'H'),
+        ('guid', '16s'),
+        ('version_major', 'B'),
+        ('version_minor', 'B'),
+        ('system_identifier', '32s'),
+        ('generating_software', '32s'),
+        ('created_day', 'H'),
+        ('created_year', 'H'),
+        ('header_size', 'H'),
+        ('offset_to_point_data', 'I'),
+        ('num_vlrs', 'I'),
+        ('data_format_id', 'B'),
+        ('data_record_length', 'H'),
+        ('legacy_point_records_count', 'I'),
+        ('legacy_point_return_count', '5I'),
+        ('x_scale', 'd'), ('y_scale', 'd'), ('z_scale', 'd'),
+        ('x_offset', 'd'), ('y_offset', 'd'), ('z_offset', 'd'),
+        ('x_max', 'd'), ('x_min', 'd'),
+        ('y_max', 'd'), ('y_min', 'd'),
+        ('z_max', 'd'), ('z_min', 'd'),
+        ]
+
+    las13_fields = [
+        ('start_of_waveform_data_packet_record', 'Q'),
+        ]
+
+    las14_fields = [
+        ('start_of_first_evlr', 'Q'),
+        ('num_evlrs', 'I'),
+        ('point_records_count', 'Q'),
+        ('point_return_count', '15Q'),
+        ]
+
+    vlr_header_struct = struct.Struct('<H16sHH32s')
+    public_header_size = 227
+    max_header_size = 375
+
+    # (byte offset, dtype) of the point record fields, by PDRF family
+    # (field names follow laspy)
+    legacy_point_fields = {
+        'X': (0, '<i4'),
+        'Y': (4, '<i4'),
+        'Z': (8, '<i4'),
+        'intensity': (12, '<u2'),
+        'flag_byte': (14, 'u1'),
+        'raw_classification': (15, 'u1'),
+        'scan_angle_rank': (16, 'i1'),
+        'user_data': (17, 'u1'),
+        'pt_src_id': (18, '<u2'),
+        'gps_time': (20, '<f8'),
+        }
+
+    extended_point_fields = {
+        'X': (0, '<i4'),
+        'Y': (4, '<i4'),
+        'Z': (8, '<i4'),
+        'intensity': (12, '<u2'),
+        'flag_byte': (14, 'u1'),
+        'classification_flags': (15, 'u1'),
+        'classification_byte': (16, 'u1'),
+        'user_data': (17, 'u1'),
+        'scan_angle': (18, '<i2'),
+        'pt_src_id': (20, '<u2'),
+        'gps_time': (22, '<f8'),
+        }
+
+    def __init__(self, las_path):
+        self.path = las_path
+        self.properties = {}
+        self.vlrs = []
+
+        with open(self.path, 'rb') as f:
+            raw = f.read(self.max_header_size)
+            if raw[:4] != b'LASF':
+                raise ValueError(f'{self.path} is not a LAS file')
+            if len(raw) < self.public_header_size:  # e.g., a copy that failed
+                raise ValueError(f'{self.path} has a truncated header')
+
+            offset = self.unpack_fields(raw, 0, self.public_header_fields)
+            header_size = self.properties['header_size']
+            if self.properties['version_minor'] >= 3 and header_size >= 235:
+                offset = self.unpack_fields(raw, offset, self.las13_fields)
+            if self.properties['version_minor'] >= 4 and header_size >= 375:
+                self.unpack_fields(raw, offset, self.las14_fields)
+
+            f.seek(header_size)
+            self.read_vlrs(f)
+            self.bytes_read = len(raw) + f.tell() - header_size
+
+        # LASzip flags compression in the 2 high bits of the format id
+        data_format_id = self.properties['data_format_id']
+        self.is_compressed = bool(data_format_id & 0xC0)
+        self.properties['data_format_id'] = data_format_id & 0x3F
+
+        point_records_count = self.properties.get('point_records_count')
+        if not point_records_count:
+            point_records_count = self.properties['legacy_point_records_count']
+        self.num_points = point_records_count
+
+    def unpack_fields(self, raw, offset, fields):
+        for name, fmt in fields:
+            fmt_struct = struct.Struct('<' + fmt)
+            values = fmt_struct.unpack_from(raw, offset)
+            self.properties[name] = values[0] if len(values) == 1 else list(values)
+            offset += fmt_struct.size
+        return offset
+
+    def read_vlrs(self, f):
+        for _ in range(self.properties['num_vlrs']):
+            vlr_header = f.read(self.vlr_header_struct.size)
+            if len(vlr_header) < self.vlr_header_struct.size:
+                logging.debug(f'{self.path} has a truncated VLR block')
+                break
+            __, user_id, record_id, length, description = \
+                self.vlr_header_struct.unpack(vlr_header)
+            body = f.read(length)
+            self.vlrs.append(LasVlr(
+                user_id.rstrip(b'\x00').decode('ascii', 'replace'),
+                record_id,
+                description.rstrip(b'\x00').decode('ascii', 'replace'),
+                body))
+
+    def get_header_property(self, name):
+        return self.properties[name]
+
+    def get_point_fields(self):
+        pdrf = self.properties['data_format_id']
+        if pdrf >= 6:
+            return self.extended_point_fields
+        elif pdrf in (1, 3, 4, 5):
+            return self.legacy_point_fields
+        else:  # PDRF 0 and 2 have no gps time
+            return {k: v for k, v in self.legacy_point_fields.items() if k != 'gps_time'}
+
+    def get_class_field(self):
+        if self.properties['data_format_id'] >= 6:
+            return 'classification_byte'
+        else:
+            return 'raw_classification'
+
+    def get_surface_classes(self):
+        # ground, and bathymetric bottom (40 in the PDRF 6-10 class table,
+        # 26 in the topo-bathy profile's for PDRF 0-5)
+        if self.properties['data_format_id'] >= 6:
+            return 2, 40
+        else:
+            return 2, 26
+
+    def get_point_dtype(self, field_names=None):
+        # only the requested fields are named; the rest of each record is
+        # skipped over via the itemsize
+        point_fields = self.get_point_fields()
+        if field_names is None:
+            field_names = list(point_fields.keys())
+        return np.dtype({
+            'names': field_names,
+            'formats': [point_fields[n][1] for n in field_names],
+            'offsets': [point_fields[n][0] for n in field_names],
+            'itemsize': self.properties['data_record_length']})
+
+    def get_vlr_body(self, user_id, record_id):
+        for vlr in self.vlrs:
+            if vlr.user_id == user_id and vlr.record_id == record_id:
+                return vlr.body
+        return None
+
+    def get_wkt(self):
+        wkt_body = self.get_vlr_body('LASF_Projection', 2112)
+        if wkt_body:
+            return wkt_body.rstrip(b'\x00').decode('ascii', 'replace')
+        return None
+
+
+class SrsCache:
+
+    # tiles in a project almost always carry byte-identical SRS VLRs, so
+    # the resolved names are cached on a hash of the VLR bodies
+    srs_vlr_ids = [2112, 34735, 34736, 34737]
+
+    projected_cs_key = 3072
+    projected_citation_key = 3073
+    vertical_cs_key = 4096
+    vertical_citation_key = 4097
+    user_defined = 32767
+
+    instances = {}
+
+    def __init__(self, cache_json=None):
+        self.cache_json = cache_json
+        self.srs = {}
+        if self.cache_json:
+            self.srs.update(self.load())
+
+    @classmethod
+    def shared(cls, cache_json=None):
+        # one cache per process, so a worker resolves each SRS only once
+        if cache_json not in cls.instances:
+            cls.instances[cache_json] = cls(cache_json)
+        return cls.instances[cache_json]
+
+    def load(self):
+        try:
+            with open(self.cache_json) as f:
+                return {k: tuple(v) for k, v in json.load(f).items()}
+        except Exception as e:
+            logging.debug(e)
+            return {}
+
+    def save(self):
+        # other workers may have added entries since this one last loaded
+        srs = self.load()
+        srs.update(self.srs)
+        tmp_json = f'{self.cache_json}.{os.getpid()}.tmp'
+        try:
+            with open(tmp_json, 'w') as f:
+                json.dump(srs, f, indent=2)
+            os.replace(tmp_json, self.cache_json)
+        except Exception as e:
+            logging.debug(e)
+
+    def get_key(self, las_header):
+        srs_hash = hashlib.sha1()
+        for vlr in las_header.vlrs:
+            if vlr.user_id == 'LASF_Projection' and vlr.record_id in self.srs_vlr_ids:
+                srs_hash.update(struct.pack('<HI', vlr.record_id, len(vlr.body)))
+                srs_hash.update(vlr.body)
+        return srs_hash.hexdigest()
+
+    def get_srs(self, las_header):
+        key = self.get_key(las_header)
+        if key not in self.srs:
+            self.srs[key] = self.resolve(las_header)
+            if self.cache_json:
+                self.save()
+        return self.srs[key]
+
+    def resolve(self, las_header):
+        wkt_str = las_header.get_wkt()
+        if wkt_str:
+            srs = osr.SpatialReference(wkt=wkt_str)
+            return srs.GetAttrValue('projcs'), srs.GetAttrValue('vert_cs')
+
+        geo_keys = self.get_geo_keys(las_header)
+        hor_srs = self.resolve_geo_key(geo_keys, self.projected_cs_key, 
+                                       self.projected_citation_key, 'projcs')
+        ver_srs = self.resolve_geo_key(geo_keys, self.vertical_cs_key, 
+                                       self.vertical_citation_key, 'vert_cs')
+        return hor_srs, ver_srs
+
+    def resolve_geo_key(self, geo_keys, cs_key, citation_key, node):
+        code = geo_keys.get(cs_key)
+        if isinstance(code, int) and 0 < code < self.user_defined:
+            srs = osr.SpatialReference()
+            if srs.ImportFromEPSG(code) == 0:
+                return srs.GetAttrValue(node)
+        citation = geo_keys.get(citation_key)
+        return citation if isinstance(citation, str) and citation else None
+
+    @staticmethod
+    def get_geo_keys(las_header):
+        directory = las_header.get_vlr_body('LASF_Projection', 34735)
+        if not directory:
+            return {}
+        doubles = las_header.get_vlr_body('LASF_Projection', 34736) or b''
+        ascii_params = las_header.get_vlr_body('LASF_Projection', 34737) or b''
+
+        shorts = struct.unpack(f'<{len(directory) // 2}H', directory)
+        num_keys = shorts[3]
+        geo_keys = {}
+        for i in range(num_keys):
+            key_id, location, count, value = shorts[4 + i * 4:8 + i * 4]
+            if location == 0:
+                geo_keys[key_id] = value
+            elif location == 34736:
+                geo_keys[key_id] = struct.unpack_from(f'<{count}d', doubles, value * 8)
+            elif location == 34737:
+                text = ascii_params[value:value + count].decode('ascii', 'replace')
+                geo_keys[key_id] = text.rstrip('|\x00')
+        return geo_keys
+
+
+class TileTimer:
+
+    # wall and CPU time, and bytes read, of each stage of a tile's QAQC; a
+    # stage's time excludes that of the stages timed within it, so the 
+    # stages add up to the tile's total
+
+    def __init__(self):
+        self.stages = {}
+        self.nested = []  # time of the stages within each open stage
+
+    def get_stage(self, stage):
+        return self.stages.setdefault(stage, {'wall': 0.0, 'cpu': 0.0, 'bytes': 0})
+
+    @contextmanager
+    def time(self, stage, num_bytes=0):
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        self.nested.append([0.0, 0.0])
+        try:
+            yield
+        finally:
+            nested_wall, nested_cpu = self.nested.pop()
+            wall = time.perf_counter() - wall
+            cpu = time.process_time() - cpu
+            timing = self.get_stage(stage)
+            timing['wall'] += wall - nested_wall
+            timing['cpu'] += cpu - nested_cpu
+            timing['bytes'] += num_bytes
+            if self.nested:
+                self.nested[-1][0] += wall
+                self.nested[-1][1] += cpu
+
+    def get_totals(self):
+        return {k: sum(t[k] for t in self.stages.values()) for k in ('wall', 'cpu', 'bytes')}
+
+    def add_bytes(self, stage, num_bytes):
+        self.get_stage(stage)['bytes'] += num_bytes
+
+
 class LasTile:
 
-    def __init__(self, las_path, config):
+    def __init__(self, las_path, config, header_only=False, timer=None):
 
         def get_useful_las_header_info():
             info_to_get = 'global_encoding,version_major,version_minor,' \
@@ -469,29 +937,20 @@ class LasTile:
                           'x_min,x_max,y_min,y_max'
             header = {}
             for info in info_to_get.split(','):
-                header[info] = self.inFile.header.reader.get_header_property(info)           
+                header[info] = self.las_header.get_header_property(info)
             self.version = f"{header['version_major']}.{header['version_minor']}"
             return header
 
         def get_vlrs():
             vlrs = {}
-            for i, vlr in enumerate(self.inFile.header.vlrs):
-                vlrs.update({vlr.record_id: vlr.parsed_body})
+            for vlr in self.las_header.vlrs:
+                vlrs.update({vlr.record_id: vlr.body})
             return vlrs
 
-        def get_srs(las_path):
+        def get_srs():
             try:
-                las = str(las_path).replace('\\', '/')
-                cmd_str = 'pdal info {} --metadata'.format(las)
-                metadata = self.run_console_cmd(cmd_str)[1].decode('utf-8')
-                meta_dict = json.loads(metadata)
-                srs = meta_dict['metadata']['srs']
-                hor_wkt = srs['horizontal']
-                ver_wkt = srs['vertical']
-                hor_srs=osr.SpatialReference(wkt=hor_wkt)
-                ver_srs=osr.SpatialReference(wkt=ver_wkt)   
-                hor_srs = hor_srs.GetAttrValue('projcs')
-                ver_srs = ver_srs.GetAttrValue('vert_cs')               
+                srs_cache = SrsCache.shared(self.config.srs_cache_json)
+                hor_srs, ver_srs = srs_cache.get_srs(self.las_header)
             except Exception as e:
                 logging.debug(e)
                 hor_srs = ver_srs = None
@@ -507,16 +966,26 @@ class LasTile:
             las_centroid_y = self.las_extents['ExtentYMax'] - dy / 2
             return (las_centroid_x, las_centroid_y)
 
-        tic = time.time()
+        self.timer = timer or TileTimer()
 
         self.path = las_path
         self.las_str = str(self.path).replace('\\', '/')
         self.name = os.path.splitext(las_path.split(os.sep)[-1])[0]
+        self.surface_name = self.get_surface_name(las_path, config.las_tile_dir)
         self.version = None
         self.has_wkt = None
         self.refraction_bit_set = None
-        self.inFile = File(self.path, mode="r")
+        self.header_only = header_only
+        with self.timer.time('header'):
+            self.las_header = LasHeader(self.path)
+        self.timer.add_bytes('header', self.las_header.bytes_read)
         self.config = config
+
+        # the point records are only mapped for the point-level checks
+        if header_only or self.las_header.is_compressed:
+            self.points = None
+        else:
+            self.points = self.get_points()
         self.is_pyramided = os.path.isfile(self.path.replace('.las', '.qvr'))
         self.to_pyramid = self.config.to_pyramid
 
@@ -541,8 +1010,7 @@ class LasTile:
         point = Point(self.las_centroid_x, self.las_centroid_y)
         self.las_centroid_wkt = wkt.dumps(point)
         
-        self.ground_class = {'1.2': '2', '1.4': '2'}
-        self.bathy_class = {'1.2': '26', '1.4': '40'}
+        self.surface_rasters = {}  # (profile, data) of those gridded in the point scan
 
         self.checks_result = {
             'naming': None,
@@ -556,7 +1024,11 @@ class LasTile:
         }
 
         self.vlrs = get_vlrs()
-        self.hor_srs, self.ver_srs = get_srs(self.path)
+        if self.config.checks_to_do['hdatum'] or self.config.checks_to_do['vdatum']:
+            with self.timer.time('srs'):
+                self.hor_srs, self.ver_srs = get_srs()
+        else:
+            self.hor_srs = self.ver_srs = None
 
         self.info_to_output = {
             'tile_name': self.name,
@@ -570,7 +1042,19 @@ class LasTile:
             }
 
         if self.version == '1.4':
-            self.has_wkt = self.inFile.header.get_wkt()
+            self.has_wkt = self.las_header.get_wkt()
+
+    @staticmethod
+    def get_surface_name(las_path, las_tile_dir):
+        # the tile's path under las_tile_dir, so tiles with the same name in 
+        # different subfolders don't overwrite each other's surfaces
+        try:
+            rel_path = Path(os.path.relpath(las_path, las_tile_dir))
+        except ValueError:  # on another drive
+            rel_path = Path(os.path.basename(las_path))
+        if rel_path.parts[0] == os.pardir:
+            rel_path = Path(rel_path.name)
+        return '_'.join(rel_path.with_suffix('').parts)
 
     @staticmethod
     def run_console_cmd(cmd):
@@ -582,33 +1066,120 @@ class LasTile:
         returncode = process.poll()
         return returncode, output
 
+    # header keys not output because of repitition
+    repeated_header_keys = ['VLRs', 'version_major', 'version_minor', 
+                            'global_encoding', 'data_format_id']
+
     def __str__(self):
-        # del keys that are not needed because of repitition
-        self.info_to_output['header'].pop('VLRs', None)
-        self.info_to_output['header'].pop('version_major', None)
-        self.info_to_output['header'].pop('version_minor', None)
-        self.info_to_output['header'].pop('global_encoding', None)
-        self.info_to_output['header'].pop('data_format_id', None)
+        for k in self.repeated_header_keys:
+            self.info_to_output['header'].pop(k, None)
         return json.dumps(self.info_to_output, indent=2)
 
-    def output_las_qaqc_to_json(self):
-        json_file_name = r'{}\{}.json'.format(self.config.json_dir, self.name)
-        with open(json_file_name, 'w') as json_file:
-            json_file.write(str(self))
+    def get_surface_bounds(self):
+        # the surface extents come from the header, not a pass over the
+        # points, and are snapped out to the tile_size grid if configured
+        x_min, x_max = self.las_extents['ExtentXMin'], self.las_extents['ExtentXMax']
+        y_min, y_max = self.las_extents['ExtentYMin'], self.las_extents['ExtentYMax']
+        if self.config.snap_to_tile_grid:
+            tile_size = self.config.tile_size
+            x_min = np.floor(x_min / tile_size) * tile_size
+            y_min = np.floor(y_min / tile_size) * tile_size
+            x_max = max(np.ceil(x_max / tile_size) * tile_size, x_min + tile_size)
+            y_max = max(np.ceil(y_max / tile_size) * tile_size, y_min + tile_size)
+        return float(x_min), float(x_max), float(y_min), float(y_max)
+
+    def get_point_bytes(self):
+        # what a pass over the point records reads (LAZ is read whole)
+        if self.las_header.is_compressed:
+            return os.path.getsize(self.path)
+        point_dtype = self.las_header.get_point_dtype()
+        return self.las_header.num_points * point_dtype.itemsize
+
+    def get_record(self):
+        # a flat, picklable summary of the tile that is sent back to the parent
+        def flatten_dict(d_obj):
+            for k, v in d_obj.items():
+                if isinstance(v, dict):
+                    for d in flatten_dict(v):
+                        yield d
+                else:
+                    yield k, v
 
-    def get_class_counts(self):
-        points = self.inFile.points['point']
-        class_keys = {
-            '1.2': 'raw_classification',
-            '1.4': 'classification_byte'
-            }
-        class_key = class_keys[self.get_las_version()]
-        bin_counts = np.bincount(points[class_key])
-        self.classes_present = np.where(bin_counts > 0)[0]  # i.e., indices
-        class_counts = bin_counts[self.classes_present]
-        class_labels = [f'class{str(c)}' for c in self.classes_present]
-        self.class_counts = dict(zip(class_labels, [int(c) for c in class_counts]))   
-        self.info_to_output['class_counts'] = self.class_counts
+        record = {'las_path': str(self.path)}
+        for k, v in flatten_dict(self.info_to_output):
+            if k not in self.repeated_header_keys:
+                record[k] = v.item() if isinstance(v, np.generic) else v
+        return record
+
+    def get_points(self, field_names=None):
+        # the point records are mapped, not read; slicing a field only
+        # touches the pages that hold it and copies nothing
+        point_dtype = self.las_header.get_point_dtype(field_names)
+        offset = self.las_header.get_header_property('offset_to_point_data')
+        num_points = self.las_header.num_points
+
+        num_points_in_file = (os.path.getsize(self.path) - offset) // point_dtype.itemsize
+        if num_points_in_file < num_points:
+            logging.debug(f'{self.name} has fewer points than its header reports')
+            num_points = max(num_points_in_file, 0)
+
+        if not num_points:
+            return np.zeros(0, dtype=point_dtype)
+
+        return np.memmap(self.path, dtype=point_dtype, mode='r', 
+                         offset=offset, shape=(num_points,))
+
+    def iter_compressed_points(self, field_names, chunk_size):
+        # LAZ can't be mapped, so PDAL decompresses the tile a chunk at a 
+        # time (keeping the worker's peak memory fixed, as for LAS) and 
+        # the dimensions are packed back into the LAS record fields
+        pipeline = pdal.Pipeline(json.dumps({'pipeline': [
+            {'type': 'readers.las', 'filename': self.las_str}]}))
+        for pdal_points in pipeline.iterator(chunk_size=chunk_size):
+            yield self.pack_pdal_points(pdal_points, field_names)
+
+    def pack_pdal_points(self, pdal_points, field_names):
+        points = np.zeros(pdal_points.size, 
+                          dtype=self.las_header.get_point_dtype(field_names))
+        for name in field_names:
+            if name in ('X', 'Y', 'Z'):
+                scale = self.las_header.get_header_property(f'{name.lower()}_scale')
+                offset = self.las_header.get_header_property(f'{name.lower()}_offset')
+                points[name] = np.round((pdal_points[name] - offset) / scale)
+            elif name == 'flag_byte':
+                shift = 4 if self.las_header.get_header_property('data_format_id') >= 6 else 3
+                points[name] = pdal_points['ReturnNumber'] | \
+                    (pdal_points['NumberOfReturns'] << shift)
+            elif name == 'raw_classification':
+                points[name] = pdal_points['Classification'] | \
+                    (pdal_points['Synthetic'] << 5) | \
+                    (pdal_points['KeyPoint'] << 6) | \
+                    (pdal_points['Withheld'] << 7)
+            else:
+                pdal_dims = {
+                    'intensity': 'Intensity',
+                    'classification_byte': 'Classification',
+                    'user_data': 'UserData',
+                    'pt_src_id': 'PointSourceId',
+                    'gps_time': 'GpsTime',
+                    'scan_angle_rank': 'ScanAngleRank',
+                    }
+                points[name] = pdal_points[pdal_dims[name]]
+        return points
+
+    def iter_points(self, field_names, chunk_size=None):
+        chunk_size = chunk_size or self.config.point_chunk_size
+
+        if self.las_header.is_compressed:
+            yield from self.iter_compressed_points(field_names, chunk_size)
+            return
+        elif self.points is not None:
+            points = self.points[field_names]
+        else:
+            points = self.get_points(field_names)
+
+        for i in range(0, points.size, chunk_size):
+            yield points[i:i + chunk_size]
 
     def get_gps_time(self):
         gps_times = {0: 'GPS Week Time', 1: 'Satellite GPS Time'}
@@ -625,9 +1196,6 @@ class LasTile:
     def get_las_pdrf(self):
         return self.header['data_format_id']
 
-    def get_pt_src_ids(self):
-        return np.unique(self.inFile.pt_src_id)
-
     def get_refraction_bit(self):
         try:
            vlr_104 = self.vlrs['104']
@@ -637,33 +1205,452 @@ class LasTile:
             self.refraction_bit_set = 'not_present'
 
 
+class ClassCountsAccumulator:
+
+    def __init__(self, tile):
+        self.class_field = tile.las_header.get_class_field()
+        self.fields = [self.class_field]
+        self.bin_counts = np.zeros(256, dtype=np.int64)
+
+    def update(self, points):
+        self.bin_counts += np.bincount(points[self.class_field], minlength=256)
+
+    def finalize(self, tile):
+        tile.classes_present = np.where(self.bin_counts > 0)[0]  # i.e., indices
+        class_counts = self.bin_counts[tile.classes_present]
+        class_labels = [f'class{str(c)}' for c in tile.classes_present]
+        tile.class_counts = dict(zip(class_labels, [int(c) for c in class_counts]))
+        tile.info_to_output['class_counts'] = tile.class_counts
+
+
+class PointSourceIdsAccumulator:
+
+    def __init__(self, tile):
+        self.fields = ['pt_src_id']
+        self.bin_counts = np.zeros(65536, dtype=np.int64)
+
+    def update(self, points):
+        self.bin_counts += np.bincount(points['pt_src_id'], minlength=65536)
+
+    def finalize(self, tile):
+        tile.pt_src_ids = [int(i) for i in np.where(self.bin_counts > 0)[0]]
+
+
+class PointStatsAccumulator:
+
+    def __init__(self, tile):
+        self.fields = ['Z', 'intensity', 'flag_byte']
+        self.z_scale = tile.las_header.get_header_property('z_scale')
+        self.z_offset = tile.las_header.get_header_property('z_offset')
+
+        # return number and number of returns share the flag byte
+        if tile.las_header.get_header_property('data_format_id') >= 6:
+            self.return_bits = (0x0F, 4)
+        else:
+            self.return_bits = (0x07, 3)
+
+        self.num_points = 0
+        self.z_min = self.z_max = None
+        self.z_sum = 0
+        self.int_min = self.int_max = None
+        self.int_sum = 0
+        self.num_first = self.num_last = self.num_only = 0
+
+    def update(self, points):
+        if not points.size:
+            return
+
+        z = points['Z']
+        intensity = points['intensity']
+        self.num_points += points.size
+        self.z_sum += int(z.sum(dtype=np.int64))
+        self.int_sum += int(intensity.sum(dtype=np.int64))
+        self.z_min = min(int(z.min()), self.z_min) if self.z_min is not None else int(z.min())
+        self.z_max = max(int(z.max()), self.z_max) if self.z_max is not None else int(z.max())
+        self.int_min = min(int(intensity.min()), self.int_min) if self.int_min is not None else int(intensity.min())
+        self.int_max = max(int(intensity.max()), self.int_max) if self.int_max is not None else int(intensity.max())
+
+        mask, shift = self.return_bits
+        return_num = points['flag_byte'] & mask
+        num_returns = (points['flag_byte'] >> shift) & mask
+        self.num_first += int(np.count_nonzero(return_num == 1))
+        self.num_last += int(np.count_nonzero(return_num == num_returns))
+        self.num_only += int(np.count_nonzero(num_returns == 1))
+
+    def finalize(self, tile):
+        def scale_z(z):
+            return z * self.z_scale + self.z_offset if z is not None else None
+
+        if self.num_points:
+            z_mean = scale_z(self.z_sum / self.num_points)
+            int_mean = self.int_sum / self.num_points
+        else:
+            z_mean = int_mean = None
+
+        tile.point_stats = {
+            'num_points': self.num_points,
+            'z_min': scale_z(self.z_min),
+            'z_max': scale_z(self.z_max),
+            'z_mean': z_mean,
+            'int_min': self.int_min,
+            'int_max': self.int_max,
+            'int_mean': int_mean,
+            'num_first': self.num_first,
+            'num_last': self.num_last,
+            'num_only': self.num_only,
+            }
+        tile.info_to_output['point_stats'] = tile.point_stats
+
+
+class SurfaceGridAccumulator:
+
+    # grids the last and only returns of the ground and bathy classes (the 
+    # points the PDAL surface pipelines keep) over the tile's extents
+
+    nodata = -9999
+
+    def __init__(self, tile):
+        las_header = tile.las_header
+        self.class_field = las_header.get_class_field()
+        self.fields = ['X', 'Y', 'Z', 'flag_byte', self.class_field]
+        self.classes = list(las_header.get_surface_classes())
+        self.scales = [las_header.get_header_property(f'{a}_scale') for a in 'xyz']
+        self.offsets = [las_header.get_header_property(f'{a}_offset') for a in 'xyz']
+
+        # return number and number of returns share the flag byte
+        if las_header.get_header_property('data_format_id') >= 6:
+            self.return_bits = (0x0F, 4)
+        else:
+            self.return_bits = (0x07, 3)
+
+        # the coarser levels (and their names) are grouped from this grid
+        self.levels = []
+        for name, (stype, resolution) in tile.config.surface_outputs.items():
+            if stype == self.stype:
+                if name == stype:
+                    self.resolution = resolution
+                self.levels.append((name, resolution))
+        self.levels = [(name, int(round(r / self.resolution))) for name, r in self.levels]
+
+        # with coarser levels, the origin is snapped out to the coarsest 
+        # resolution, so their cells line up across tiles (and in the mosaics)
+        self.x_min, x_max, y_min, self.y_max = tile.get_surface_bounds()
+        coarsest = self.resolution * max(factor for name, factor in self.levels)
+        if coarsest > self.resolution:
+            self.x_min = float(np.floor(self.x_min / coarsest) * coarsest)
+            self.y_max = float(np.ceil(self.y_max / coarsest) * coarsest)
+        if tile.config.snap_to_tile_grid:  # the tile edges are cell edges
+            self.width = int(np.ceil((x_max - self.x_min) / self.resolution))
+            self.height = int(np.ceil((self.y_max - y_min) / self.resolution))
+        else:
+            self.width = int((x_max - self.x_min) / self.resolution) + 1
+            self.height = int((self.y_max - y_min) / self.resolution) + 1
+        self.num_cells = self.width * self.height
+        self.crs = f'EPSG:{tile.config.epsg_code}'
+
+    def get_cells(self, points):
+        # the flat cell index and Z of the points that go in the surface,
+        # and those points
+        classes = points[self.class_field]
+        if self.class_field == 'raw_classification':
+            classes = classes & 0x1F  # the other bits are flags
+        mask, shift = self.return_bits
+        return_num = points['flag_byte'] & mask
+        num_returns = (points['flag_byte'] >> shift) & mask
+        keep = np.isin(classes, self.classes) & (return_num == num_returns) & (num_returns > 0)
+        points = points[keep]
+
+        x = points['X'] * self.scales[0] + self.offsets[0]
+        y = points['Y'] * self.scales[1] + self.offsets[1]
+        z = points['Z'] * self.scales[2] + self.offsets[2]
+        col = np.clip(((x - self.x_min) / self.resolution).astype(np.int64), 0, self.width - 1)
+        row = np.clip(((self.y_max - y) / self.resolution).astype(np.int64), 0, self.height - 1)
+        return row * self.width + col, z, points
+
+    def get_shape(self, factor=1):
+        return -(-self.height // factor), -(-self.width // factor)
+
+    def aggregate(self, grid, factor, ufunc=np.add, fill=0):
+        # the flat grid reduced over factor x factor blocks of cells (those
+        # past the grid's edge are fill)
+        if factor == 1:
+            return grid
+        height, width = self.get_shape(factor)
+        padded = np.full((height * factor, width * factor), fill, dtype=grid.dtype)
+        padded[:self.height, :self.width] = grid.reshape(self.height, self.width)
+        blocks = padded.reshape(height, factor, width, factor)
+        return ufunc.reduce(ufunc.reduce(blocks, axis=3), axis=1).ravel()
+
+    def get_profile(self, factor=1):
+        height, width = self.get_shape(factor)
+        resolution = self.resolution * factor
+        return {
+            'driver': 'GTiff',
+            'dtype': 'float32',
+            'nodata': self.nodata,
+            'width': width,
+            'height': height,
+            'count': 1,
+            'crs': self.crs,
+            'transform': rasterio.transform.from_origin(
+                self.x_min, self.y_max, resolution, resolution),
+            }
+
+    def finalize(self, tile):
+        for name, factor in self.levels:
+            surface = self.get_surface(factor)
+            data = surface.reshape(1, *self.get_shape(factor))
+            tile.surface_rasters[name] = (self.get_profile(factor), data)
+
+
+class MeanZGridAccumulator(SurfaceGridAccumulator):
+
+    # count and sum (or min or max) of Z per cell (and the output), for
+    # the DEM; only the grid the stat needs is kept
+    stype = 'DEM'
+    bytes_per_cell = 2 * 8 + 4
+
+    def __init__(self, tile, stat='mean'):
+        super().__init__(tile)
+        self.stat = stat
+        self.count = np.zeros(self.num_cells, dtype=np.int64)
+        if self.stat == 'mean':
+            self.z_sum = np.zeros(self.num_cells)
+        elif self.stat == 'min':
+            self.z_min = np.full(self.num_cells, np.inf)
+        elif self.stat == 'max':
+            self.z_max = np.full(self.num_cells, -np.inf)
+
+    def update(self, points):
+        cells, z, _ = self.get_cells(points)
+        if not cells.size:
+            return
+        self.count += np.bincount(cells, minlength=self.num_cells)
+        if self.stat == 'mean':
+            self.z_sum += np.bincount(cells, weights=z, minlength=self.num_cells)
+            return
+
+        # min or max by cell, over the points sorted by cell
+        order = np.argsort(cells, kind='stable')
+        cells, z = cells[order], z[order]
+        starts = np.flatnonzero(np.r_[True, cells[1:] != cells[:-1]])
+        unique_cells = cells[starts]
+        if self.stat == 'min':
+            self.z_min[unique_cells] = np.minimum(self.z_min[unique_cells], np.minimum.reduceat(z, starts))
+        else:
+            self.z_max[unique_cells] = np.maximum(self.z_max[unique_cells], np.maximum.reduceat(z, starts))
+
+    def get_surface(self, factor=1):
+        count = self.aggregate(self.count, factor)
+        has_points = count > 0
+        surface = np.full(count.size, self.nodata, dtype=np.float32)
+        if self.stat == 'mean':
+            z_sum = self.aggregate(self.z_sum, factor)
+            surface[has_points] = z_sum[has_points] / count[has_points]
+        elif self.stat == 'min':
+            z_min = self.aggregate(self.z_min, factor, np.minimum, np.inf)
+            surface[has_points] = z_min[has_points]
+        elif self.stat == 'max':
+            z_max = self.aggregate(self.z_max, factor, np.maximum, -np.inf)
+            surface[has_points] = z_max[has_points]
+        return surface
+
+
+class DzGridAccumulator(SurfaceGridAccumulator):
+
+    # the spread (max - min) of the flightlines' mean Z in each cell; a sum
+    # and count grid is only kept for the flightlines in the tile
+    stype = 'Dz'
+    expected_flightlines = 4  # for the memory estimate
+    bytes_per_cell = expected_flightlines * (8 + 4) + 4
+
+    def __init__(self, tile):
+        super().__init__(tile)
+        self.fields = self.fields + ['pt_src_id']
+        self.z_sums = {}
+        self.counts = {}
+
+    def update(self, points):
+        cells, z, points = self.get_cells(points)
+        pt_src_ids = points['pt_src_id']
+        for pt_src_id in np.unique(pt_src_ids):
+            if pt_src_id not in self.z_sums:
+                self.z_sums[pt_src_id] = np.zeros(self.num_cells)
+                self.counts[pt_src_id] = np.zeros(self.num_cells, dtype=np.int32)
+            in_flightline = pt_src_ids == pt_src_id
+            fl_cells = cells[in_flightline]
+            self.z_sums[pt_src_id] += np.bincount(fl_cells, weights=z[in_flightline], minlength=self.num_cells)
+            self.counts[pt_src_id] += np.bincount(fl_cells, minlength=self.num_cells).astype(np.int32)
+
+    def get_surface(self, factor=1):
+        num_cells = np.prod(self.get_shape(factor))
+        z_max = np.full(num_cells, np.nan)
+        z_min = np.full(num_cells, np.nan)
+        for pt_src_id, z_sum in self.z_sums.items():
+            z_sum = self.aggregate(z_sum, factor)
+            count = self.aggregate(self.counts[pt_src_id], factor)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                z_mean = z_sum / count  # nan where the flightline has no points
+            z_max = np.fmax(z_max, z_mean)
+            z_min = np.fmin(z_min, z_mean)
+
+        # cells with one flightline (or none) have no Dz
+        dz = (z_max - z_min).astype(np.float32)
+        dz[np.isnan(dz) | (dz == 0)] = self.nodata
+        return dz
+
+
 class Mosaic:
 
+    block_size = 512  # cells; the mosaic is written, and tiled, in blocks this size
+
     def __init__(self, mtype, config):
         self.mtype = mtype
         self.config = config
         self.stem = f'{self.config.project_name}_{self.mtype}_mosaic'
         self.basename = self.stem + '.tif'
-        self.path = Path(self.config.surfaces_to_make[self.mtype][1]) / self.basename
-
-    def gen_mosaic(self, vrts):
-        if vrts:
-            logging.info(f'generating {self.path}...')
-            mosaic, out_trans = rasterio.merge.merge(vrts)
-            out_meta = vrts[0].profile  # uses last src made
-            out_meta.update({
-                'driver': "GTiff",
-                'height': mosaic.shape[1],
-                'width': mosaic.shape[2],
-                'transform': out_trans})
-
-            # save mosaic DEMs
-            with rasterio.open(self.path, 'w', **out_meta) as dest:
-                dest.write(mosaic)
-            for vrt in vrts:
-                vrt.close()
-        else:
-            logging.info('No {self.mtype} tiles were generated.')
+        stype = self.config.surface_outputs[self.mtype][0]
+        self.path = Path(self.config.surfaces_to_make[stype][1]) / self.basename
+
+    @staticmethod
+    def is_nodata(data, nodata):
+        if nodata is None:
+            return np.zeros(data.shape, dtype=bool)
+        elif np.isnan(nodata):
+            return np.isnan(data)
+        return data == nodata
+
+    def get_layout(self, tif_paths):
+        # only the tiles' headers are read to lay out the mosaic's grid; 
+        # each tile gets its window in the grid, by its upper left corner
+        tiles = []
+        for tif_path in tif_paths:
+            with rasterio.open(tif_path) as src:
+                tiles.append({'path': tif_path, 'bounds': src.bounds, 'res': src.res, 
+                              'width': src.width, 'height': src.height, 'profile': src.profile})
+
+        res_x, res_y = tiles[0]['res']
+        for tile in tiles[1:]:
+            if not np.allclose(tile['res'], (res_x, res_y)):
+                logging.warning(f"{tile['path']} isn't at the mosaic's resolution; it's left out")
+        tiles = [t for t in tiles if np.allclose(t['res'], (res_x, res_y))]
+
+        west = min(t['bounds'].left for t in tiles)
+        north = max(t['bounds'].top for t in tiles)
+        for tile in tiles:
+            col_off = int(round((tile['bounds'].left - west) / res_x))
+            row_off = int(round((north - tile['bounds'].top) / res_y))
+            tile['window'] = Window(col_off, row_off, tile['width'], tile['height'])
+
+        width = max(t['window'].col_off + t['window'].width for t in tiles)
+        height = max(t['window'].row_off + t['window'].height for t in tiles)
+        transform = rasterio.transform.from_origin(west, north, res_x, res_y)
+        return tiles, width, height, transform
+
+    def get_overview_factors(self, width, height):
+        # halved until the coarsest overview fits in a block
+        factors = []
+        factor = 2
+        while max(width, height) / (factor / 2) > self.block_size:
+            factors.append(factor)
+            factor *= 2
+        return factors
+
+    def gen_mosaic(self, tif_paths):
+        # the mosaic is written a block at a time, from only the tiles that 
+        # overlap the block, so memory doesn't grow with the project; where 
+        # tiles overlap, the first one listed wins
+        tif_paths = list(tif_paths)
+        if not tif_paths:
+            logging.info(f'No {self.mtype} tiles were generated.')
+            return
+
+        logging.info(f'generating {self.path}...')
+        tiles, width, height, transform = self.get_layout(tif_paths)
+        profile = tiles[0]['profile']
+        nodata = profile.get('nodata')
+        nodata = -9999 if nodata is None else nodata
+        out_profile = dict(
+            profile, 
+            driver='GTiff', 
+            width=width, 
+            height=height, 
+            transform=transform, 
+            nodata=nodata, 
+            tiled=True, 
+            blockxsize=self.block_size, 
+            blockysize=self.block_size, 
+            compress='deflate', 
+            BIGTIFF='IF_SAFER')
+
+        # the blocks each tile overlaps, and the last block row it's needed for
+        bs = self.block_size
+        block_tiles = defaultdict(list)
+        for i, tile in enumerate(tiles):
+            window = tile['window']
+            first_row, first_col = window.row_off // bs, window.col_off // bs
+            tile['last_block_row'] = (window.row_off + window.height - 1) // bs
+            last_col = (window.col_off + window.width - 1) // bs
+            for block_row in range(first_row, tile['last_block_row'] + 1):
+                for block_col in range(first_col, last_col + 1):
+                    block_tiles[(block_row, block_col)].append(i)
+
+        tmp_path = self.path.with_name(self.stem + '.tmp.tif')
+        cog_path = self.path.with_name(self.stem + '.cog.tmp.tif')
+        srcs = {}  # only the tiles in the current block row are kept open
+        try:
+            with rasterio.open(tmp_path, 'w', **out_profile) as dst:
+                for block_row in range(-(-height // bs)):
+                    for block_col in range(-(-width // bs)):
+                        row_off, col_off = block_row * bs, block_col * bs
+                        block = Window(col_off, row_off, min(bs, width - col_off), min(bs, height - row_off))
+                        data = np.full((profile['count'], block.height, block.width), nodata, 
+                                       dtype=profile['dtype'])
+
+                        for i in block_tiles.get((block_row, block_col), []):
+                            tile = tiles[i]
+                            window = tile['window']
+                            r0 = max(window.row_off, row_off)
+                            r1 = min(window.row_off + window.height, row_off + block.height)
+                            c0 = max(window.col_off, col_off)
+                            c1 = min(window.col_off + window.width, col_off + block.width)
+                            if i not in srcs:
+                                srcs[i] = rasterio.open(tile['path'])
+                            tile_data = srcs[i].read(window=Window(
+                                c0 - window.col_off, r0 - window.row_off, c1 - c0, r1 - r0))
+                            
+                            block_data = data[:, r0 - row_off:r1 - row_off, c0 - col_off:c1 - col_off]
+                            fill = self.is_nodata(block_data, nodata) & \
+                                ~self.is_nodata(tile_data, srcs[i].nodata)
+                            block_data[fill] = tile_data[fill]
+
+                        dst.write(data, window=block)
+
+                    for i in [i for i in srcs if tiles[i]['last_block_row'] <= block_row]:
+                        srcs.pop(i).close()
+
+                if self.config.to_pyramid:
+                    logging.info(f'building the {self.mtype} mosaic overviews...')
+                    dst.build_overviews(self.get_overview_factors(width, height), Resampling.average)
+                    dst.update_tags(ns='rio_overview', resampling='average')
+
+            # copied so the overviews and tile offsets come before the blocks
+            # (a cloud-optimized GeoTIFF), so a GIS reads only what it draws
+            rasterio.shutil.copy(
+                tmp_path, cog_path, driver='GTiff', 
+                TILED='YES', 
+                BLOCKXSIZE=self.block_size, 
+                BLOCKYSIZE=self.block_size, 
+                COMPRESS='DEFLATE', 
+                BIGTIFF='IF_SAFER', 
+                COPY_SRC_OVERVIEWS='YES')
+            os.replace(cog_path, self.path)
+        finally:
+            for src in srcs.values():
+                src.close()
+            for path in (tmp_path, cog_path):
+                if path.exists():
+                    os.remove(path)
 
 
 class Surface:
@@ -671,11 +1658,12 @@ class Surface:
     def __init__(self, tile, stype, config):
         self.stype = stype
         self.las_path = tile.path
-        self.las_name = tile.name
+        self.las_name = tile.surface_name
         self.las_str = tile.las_str
         self.las_extents = tile.las_extents
         self.config = config
         self.tif_dir = Path(self.config.surfaces_to_make[self.stype][1])
+        self.resolution = self.config.surface_outputs[self.stype][1]
         self.tile = tile
 
     def __str__(self):
@@ -685,8 +1673,7 @@ class Surface:
         
         def gen_pipeline(las_bounds):
 
-            ground_class = self.tile.ground_class[self.tile.version]
-            bathy_class = self.tile.bathy_class[self.tile.version]
+            ground_class, bathy_class = self.tile.las_header.get_surface_classes()
 
             pdal_json = """{
                 "pipeline":[
@@ -714,7 +1701,7 @@ class Surface:
                         "type": "writers.gdal",
                         "gdaldriver": "GTiff",
                         "output_type": "mean",
-                        "resolution": "1.0",
+                        "resolution": """ + '"{}",'.format(self.resolution) + """
                         "bounds": """ + '"{}",'.format(las_bounds) + """
                         "filename":  """ + '"{}"'.format(self.gtiff_path) + """
                     }
@@ -726,7 +1713,7 @@ class Surface:
         def create_dz():
             tifs = []
             profile = None
-            for t in self.tif_dir.glob(f'{self.las_name}*.tif'):
+            for t in self.tif_dir.glob(f'{self.las_name}_PSI_*.tif'):
                 with rasterio.open(t, 'r') as tif:
                     data = tif.read(1)
                     tifs.append(data)
@@ -743,32 +1730,22 @@ class Surface:
             else:
                 logging.info(f'{self.las_name} has no tifs :(...')
 
-        cmd_str = 'pdal info {} --summary'.format(self.las_str)
-        stats = self.tile.run_console_cmd(cmd_str)[1]
-        stats_dict = json.loads(stats)
-
-        bounds = stats_dict['summary']['bounds']
-        minx = bounds['minx']
-        maxx = bounds['maxx']
-        miny = bounds['miny']
-        maxy = bounds['maxy']
+        # the header's extents, rather than a pdal info pass over the points
+        minx, maxx, miny, maxy = self.tile.get_surface_bounds()
         las_bounds = ([minx ,maxx], [miny, maxy])
         
         self.gtiff_path = self.tif_dir / f'{self.las_name}_PSI_#.tif'
         self.gtiff_path = str(self.gtiff_path).replace('\\', '/')
         
+        # a failed pipeline fails the tile, so it's retried or quarantined
         logging.info('generating {} surface for {}...'.format(self.stype, self.las_name))
-        try:
-            pipeline = pdal.Pipeline(gen_pipeline(las_bounds))
-            __ = pipeline.execute()
-        except Exception as e:
-            logging.info(e)
+        pipeline = pdal.Pipeline(gen_pipeline(las_bounds))
+        __ = pipeline.execute()
 
         return create_dz()
 
     def gen_mean_z_surface(self, dem_type):
-        ground_class = self.tile.ground_class[self.tile.version]
-        bathy_class = self.tile.bathy_class[self.tile.version]
+        ground_class, bathy_class = self.tile.las_header.get_surface_classes()
 
         las_str = str(self.las_path).replace('\\', '/')
         gtiff_path = f'/vsimem/{self.las_name}_{self.stype}.tif'
@@ -795,31 +1772,162 @@ class Surface:
                     "filename": """ + '"{}"'.format(gtiff_path) + """,
                     "gdaldriver": "GTiff",
                     "output_type": """ + '"{}"'.format(dem_type) + """,
-                    "resolution": "1.0",
+                    "resolution": """ + '"{}",'.format(self.resolution) + """
                     "type": "writers.gdal"
                 }
             ]
         }"""
 
         logging.info('generating {} surface for {}...'.format(self.stype, self.las_name))
+        pipeline = pdal.Pipeline(pdal_json)
+        count = pipeline.execute()
+        self.path = gtiff_path
 
-        try:
-            pipeline = pdal.Pipeline(pdal_json)
-            count = pipeline.execute()
-            self.path = gtiff_path
-        except Exception as e:
-            logging.info(e)
-            self.path = None
-            
     def detect_spikes(self):
         pass
 
 
+class ResultsStore:
+
+    table = 'tile_results'
+    column_types = {bool: 'INTEGER', int: 'INTEGER', float: 'REAL', str: 'TEXT'}
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.conn = sqlite3.connect(str(self.db_path))
+        self.conn.execute(f'CREATE TABLE IF NOT EXISTS {self.table} '
+                          '(las_path TEXT PRIMARY KEY, fingerprint TEXT)')
+        self.columns = self.get_columns()
+
+    def get_columns(self):
+        table_info = self.conn.execute(f'PRAGMA table_info({self.table})')
+        return [row[1] for row in table_info]
+
+    @staticmethod
+    def to_sql_value(value):
+        if isinstance(value, np.generic):
+            return value.item()
+        elif isinstance(value, (list, tuple, dict)):
+            return json.dumps(value)
+        return value
+
+    def add_columns(self, records):
+        # class counts and the like only show up in some tiles, so the
+        # schema grows as new fields arrive
+        new_columns = {}
+        for record in records:
+            for k, v in record.items():
+                if k in self.columns or (k in new_columns and new_columns[k] != 'TEXT'):
+                    continue
+                value = self.to_sql_value(v)
+                new_columns[k] = self.column_types.get(type(value), 'TEXT')
+
+        for k, column_type in new_columns.items():
+            self.conn.execute(f'ALTER TABLE {self.table} ADD COLUMN "{k}" {column_type}')
+            self.columns.append(k)
+
+    def insert(self, records):
+        if not records:
+            return
+        self.add_columns(records)
+        columns = ', '.join(f'"{c}"' for c in self.columns)
+        placeholders = ', '.join('?' for c in self.columns)
+        rows = [[self.to_sql_value(r.get(c)) for c in self.columns] for r in records]
+        with self.conn:
+            self.conn.executemany(f'INSERT OR REPLACE INTO {self.table} '
+                                  f'({columns}) VALUES ({placeholders})', rows)
+
+    def get_fingerprints(self):
+        rows = self.conn.execute(f'SELECT las_path, fingerprint FROM {self.table}')
+        return {las_path: fingerprint for las_path, fingerprint in rows}
+
+    def get_records(self, las_paths=None):
+        # all of them if las_paths is None
+        if las_paths is not None:
+            las_paths = set(str(p) for p in las_paths)
+        cursor = self.conn.execute(f'SELECT * FROM {self.table}')
+        columns = [d[0] for d in cursor.description]
+        records = {}
+        for row in cursor:
+            record = {k: v for k, v in zip(columns, row) if v is not None}
+            if las_paths is None or record['las_path'] in las_paths:
+                records[record['las_path']] = record
+        return records
+
+    def close(self):
+        self.conn.close()
+
+
+class TileResultCache:
+
+    def __init__(self, config, store):
+        self.config = config
+        self.settings_fingerprint = self.get_settings_fingerprint()
+        if self.config.force_rerun:
+            self.fingerprints = {}
+        else:
+            self.fingerprints = store.get_fingerprints()
+
+    def get_settings_fingerprint(self):
+        # only the settings of the enabled checks and surfaces affect a 
+        # tile's results (and the surface rasters kept from earlier runs)
+        checks = sorted(k for k, v in self.config.checks_to_do.items() if v)
+        surface_types = [k for k, v in self.config.surfaces_to_make.items() if v[0]]
+        return {
+            'checks': checks,
+            'check_keys': {c: self.config.check_keys[c] for c in checks},
+            'point_stats': self.config.point_stats,
+            'surfaces': {k: v[1] for k, v in self.config.surface_outputs.items() if v[0] in surface_types},
+            'surface_engine': self.config.surface_engine,
+            'snap_to_tile_grid': self.config.snap_to_tile_grid,
+            }
+
+    def get_fingerprint(self, las_path, size, mtime_ns):
+        # size and mtime come from the discovery scan, not another stat
+        with open(las_path, 'rb') as f:
+            header = f.read(LasHeader.max_header_size)
+            if len(header) < LasHeader.public_header_size:  # e.g., a copy that failed
+                raise ValueError(f'{las_path} has a truncated header')
+            offset_to_point_data = struct.unpack_from('<I', header, 96)[0]
+            header += f.read(max(offset_to_point_data - len(header), 0))
+
+        fingerprint = json.dumps([
+            str(las_path), 
+            size, 
+            mtime_ns, 
+            hashlib.sha1(header).hexdigest(), 
+            self.settings_fingerprint,
+            ], sort_keys=True)
+        return hashlib.sha1(fingerprint.encode('utf-8')).hexdigest()
+
+    def is_current(self, las_path, fingerprint):
+        return self.fingerprints.get(str(las_path)) == fingerprint
+
+
 class QaqcTile:
 
     passed_text = 'PASSED'
     failed_text = 'FAILED'
 
+    # checks that need the point records (all others use only the header)
+    point_checks = ['pt_src_ids', 'exp_cls']
+
+    # PDAL's writers.gdal keeps several float64 grids (min, max, mean, idw, 
+    # count, stdev) per surface
+    raster_bytes_per_cell = 6 * 8
+
+    point_accumulators = {
+        'exp_cls': ClassCountsAccumulator,
+        'pt_src_ids': PointSourceIdsAccumulator,
+        'point_stats': PointStatsAccumulator,
+        }
+
+    # surfaces gridded in the point scan, unless surface_engine is 'pdal'
+    surface_accumulators = {
+        'DEM': MeanZGridAccumulator,
+        'Dz': DzGridAccumulator,
+        }
+
     def __init__(self, config):
         self.config = config
         self.checks = {
@@ -838,6 +1946,57 @@ class QaqcTile:
             'DEM': self.create_DEM
             }
 
+        self.checks_to_run = [k for k, v in self.config.checks_to_do.items() if v]
+        self.surface_types = [k for k, v in self.config.surfaces_to_make.items() if v[0]]
+        self.surface_outputs = self.get_surface_outputs()
+        self.tile_sizes = {}  # from the discovery scan
+        self.pdal_point_sizes = {}  # by point format, see get_pdal_point_size
+
+    def get_gridded_surfaces(self):
+        if self.config.surface_engine == 'pdal':
+            return []
+        return [s for s in self.surface_types if s in self.surface_accumulators]
+
+    def get_surface_outputs(self):
+        # the coarser resolutions are aggregated from the grids in the
+        # point scan, so the PDAL surfaces only have their finest
+        surface_outputs = []
+        gridded = self.get_gridded_surfaces()
+        for name, (stype, resolution) in self.config.surface_outputs.items():
+            if stype not in self.surface_types:
+                continue
+            if name == stype or stype in gridded:
+                surface_outputs.append(name)
+            else:
+                logging.warning(f'{name} is only made by the numpy surface engine')
+        return surface_outputs
+
+    def needs_points(self, run_checks=True):
+        point_checks = [self.config.checks_to_do[c] for c in self.point_checks]
+        for_checks = run_checks and (any(point_checks) or self.config.point_stats)
+        return for_checks or bool(self.get_gridded_surfaces())
+
+    def scan_points(self, tile, run_checks=True):
+        # one pass over the point records feeds every enabled accumulator
+        accumulators = []
+        if run_checks:
+            enabled = dict(self.config.checks_to_do, point_stats=self.config.point_stats)
+            accumulators = [a(tile) for k, a in self.point_accumulators.items() if enabled[k]]
+        accumulators += [self.surface_accumulators[s](tile) for s in self.get_gridded_surfaces()]
+        if not accumulators:
+            return
+
+        field_names = []
+        for a in accumulators:
+            field_names.extend(f for f in a.fields if f not in field_names)
+
+        for points in tile.iter_points(field_names):
+            for a in accumulators:
+                a.update(points)
+
+        for a in accumulators:
+            a.finalize(tile)
+
     def check_las_naming(self, tile):
         # for now, the checks assume Northern Hemisphere
         # https://www.e-education.psu.edu/natureofgeoinfo/c2_p23.html
@@ -928,7 +2087,6 @@ class QaqcTile:
         return passed
 
     def check_unexp_cls(self, tile):
-        tile.get_class_counts()
         unexp_cls = list(set(tile.classes_present).difference(self.config.exp_cls_key))
         if not unexp_cls:
             passed = self.passed_text
@@ -951,7 +2109,7 @@ class QaqcTile:
         return passed
 
     def check_pt_src_ids(self, tile):
-        unq_pt_src_ids = tile.get_pt_src_ids()
+        unq_pt_src_ids = tile.pt_src_ids
         if len(unq_pt_src_ids) > 1:
             passed = self.passed_text
         else:
@@ -962,16 +2120,21 @@ class QaqcTile:
         return passed
 
     def create_dz(self, tile):
+        if 'Dz' in tile.surface_rasters:  # gridded in the point scan
+            return tile.surface_rasters['Dz']
+
         from qchecker import Surface
         #if tile.has_bathy or tile.has_ground:
         tile_dz = Surface(tile, 'Dz', self.config)
-        profile, data = tile_dz.create_dz_dem()
-        return profile, data
+        return tile_dz.create_dz_dem()
         #else:
         #    logging.debug(f'{tile.name} has no bathy or ground points; no dz surface generated')
         #    return None
 
     def create_DEM(self, tile):
+        if 'DEM' in tile.surface_rasters:  # gridded in the point scan
+            return tile.surface_rasters['DEM']
+
         from qchecker import Surface
         #if tile.has_bathy or tile.has_ground:
         tile_DEM = Surface(tile, 'DEM', self.config)
@@ -984,103 +2147,898 @@ class QaqcTile:
         #    logging.debug('{tile.name} has no bathy or ground points; no DEM generated')
         #    return None
 
-    def run_qaqc_checks_multiprocess(self, las_path):
-        from qchecker import LasTile, LasTileCollection
-        import logging
-        logging.basicConfig(format='%(asctime)s:%(message)s', 
-                            level=logging.WARNING)
-        tile = LasTile(las_path, self.config)
-        for c in [k for k, v in self.config.checks_to_do.items() if v]:
-            logging.debug('running {}...'.format(c))
-            result = self.checks[c](tile)
-            logging.debug(result)
-        tile.output_las_qaqc_to_json()
-
-    def run_qaqc_surfaces_multiprocess(self, shared_dict, stype, las_path):
-        from qchecker import LasTile, LasTileCollection
-        import logging
-        logging.basicConfig(format='%(asctime)s:%(message)s', 
-                            level=logging.WARNING)
-        tile = LasTile(las_path, self.config)
+    def run_qaqc_tile_multiprocess(self, task):
+        # one visit per tile: it's opened once for the checks and every surface;
+        # returns the tile's record (None if only its surfaces were made), the 
+        # timings of its stages, and the paths of its surface rasters
+        las_path, run_checks = task
+        needs_points = self.needs_points(run_checks)
+        timer = TileTimer()
+        with timer.time('open'):
+            tile = LasTile(las_path, self.config, header_only=not needs_points, timer=timer)
+
+        if needs_points:
+            with timer.time('scan', tile.get_point_bytes()):
+                self.scan_points(tile, run_checks)
+
+        record = None
+        if run_checks:
+            for c in self.checks_to_run:
+                logging.debug('running {}...'.format(c))
+                with timer.time(f'check_{c}'):
+                    result = self.checks[c](tile)
+                logging.debug(result)
+            with timer.time('result'):
+                record = tile.get_record()
 
         #tile.get_class_counts()
-        #bathy_class = tile.bathy_class[tile.version]
-        #ground_class = tile.ground_class[tile.version]
+        #ground_class, bathy_class = tile.las_header.get_surface_classes()
         #tile.has_bathy = True if 'class{}'.format(bathy_class) in tile.class_counts.keys() else False
         #tile.has_ground = True if 'class{}'.format(ground_class) in tile.class_counts.keys() else False
 
-        logging.debug('running {}...'.format(stype))
-        profile, data = self.surfaces[stype](tile)
-        shared_dict[tile.name] = [profile, data]
-        tile.output_las_qaqc_to_json()
-
-    def run_qaqc_checks(self, las_paths):
-        p = mp.Pool(processes=max(int(mp.cpu_count() / 2), 1))
-        num_las = len(las_paths)
-        for _ in tqdm(p.imap_unordered(self.run_qaqc_checks_multiprocess, 
-                                       las_paths), 
-                      total=num_las, ascii=True):
-            pass
-        p.close()
-        p.join()
-
-    def run_qaqc_surfaces(self, las_paths, stype):
-        shared_dict = mp.Manager().dict()
-        p = mp.Pool(processes=max(int(mp.cpu_count() / 2), 1))
-        num_las = len(las_paths)
-        func = partial(self.run_qaqc_surfaces_multiprocess, shared_dict, stype)
-        for _ in tqdm(p.imap_unordered(func, las_paths), 
-                      total=num_las, ascii=True):
-            pass
-        p.close()
-        p.join()
-        return shared_dict
+        # a surface that fails doesn't take the check results with it; the 
+        # error goes back with them so only the surfaces are made again
+        surfaces = {}
+        surface_errors = []
+        for stype in self.surface_types:
+            logging.debug('running {}...'.format(stype))
+            # PDAL reads the whole tile
+            num_bytes = 0 if stype in tile.surface_rasters else os.path.getsize(las_path)
+            try:
+                with timer.time(f'surface_{stype}', num_bytes):
+                    tile_surface = self.surfaces[stype](tile)
+                with timer.time('result'):
+                    surfaces[stype] = self.write_tile_surface(stype, tile.surface_name, tile_surface)
+            except Exception as e:
+                logging.exception(e)
+                surface_errors.append(f'{stype}: {e!r}')
+                surfaces[stype] = None
+
+        # the coarser resolutions were aggregated in the point scan
+        for name in self.surface_outputs:
+            if name not in surfaces:
+                try:
+                    with timer.time('result'):
+                        surfaces[name] = self.write_tile_surface(
+                            name, tile.surface_name, tile.surface_rasters.get(name))
+                except Exception as e:
+                    logging.exception(e)
+                    surface_errors.append(f'{name}: {e!r}')
+                    surfaces[name] = None
+
+        surface_error = '; '.join(surface_errors) if surface_errors else None
+        return record, timer.stages, surfaces, surface_error
+
+    def run_qaqc(self, las_tiles, store, journal, update=False):
+        # to update (in watch mode), the tiles quarantined by earlier 
+        # batches stay quarantined until they pass
+        tile_records = {}
+        fingerprints = {}
+        stored_records = {}
+        if self.checks_to_run:
+            cache = TileResultCache(self.config, store)
+            if not self.config.force_rerun:
+                stored_records = store.get_records()
+
+        tile_surfaces = {}
+        journaled_records = []
+        discovery_errors = []
+        surface_names = {}
+        num_cached = 0
+
+        def iter_tasks():
+            # consumed as tiles are discovered, in a thread when there's a 
+            # pool, so it leaves the store (and its connection) alone
+            nonlocal num_cached
+            for las_tile in las_tiles:
+                las_path = las_tile.path
+                self.tile_sizes[las_path] = las_tile.size
+
+                # e.g., a_b/c.las and a/b_c.las
+                surface_name = LasTile.get_surface_name(las_path, self.config.las_tile_dir)
+                if self.surface_types and surface_name in surface_names:
+                    error = ValueError(f'{las_path} has the same surface names as {surface_names[surface_name]}')
+                    discovery_errors.append((las_path, repr(error)))
+                    continue
+                surface_names[surface_name] = las_path
+
+                if self.checks_to_run:
+                    try:
+                        fingerprints[las_path] = cache.get_fingerprint(
+                            las_path, las_tile.size, las_tile.mtime_ns)
+                    except Exception as e:  # quarantined with the tiles that fail
+                        logging.exception(e)
+                        discovery_errors.append((las_path, repr(e)))
+                        continue
+                    if las_path in stored_records and cache.is_current(las_path, fingerprints[las_path]):
+                        tile_records[las_path] = stored_records[las_path]
+                        num_cached += 1
+
+                        # so are the surfaces it made then, if they're still there
+                        tile_surfaces.update(self.get_tile_surfaces(las_path))
+
+                # tiles finished before a resumed run died are taken from the journal
+                entry = journal.tiles.get(las_path)
+                if entry is not None:
+                    if entry['record'] is not None:
+                        tile_records[las_path] = entry['record']
+                        journaled_records.append(entry['record'])
+                    for stype, tif_path in entry['surfaces'].items():
+                        if tif_path is not None and os.path.exists(tif_path):
+                            tile_surfaces[(stype, las_path)] = tif_path
+
+                # tiles with cached check results are only visited for their surfaces
+                run_checks = bool(self.checks_to_run) and las_path not in tile_records
+                run_surfaces = any((name, las_path) not in tile_surfaces for name in self.surface_outputs)
+                if run_checks or run_surfaces:
+                    yield (las_path, run_checks)
+
+        records = []
+        quarantine = []
+        passed = []
+        tile_timings = {}
+        store_time = 0.0
+
+        def add_error(las_path, error):
+            # the error goes in the results, without a fingerprint so the 
+            # tile is tried again next run; it isn't journaled either
+            logging.error(f'{las_path} is quarantined: {error}')
+            quarantine.append({'las_path': str(las_path), 'error': error})
+            cached_record = tile_records.get(str(las_path))
+            if cached_record is not None:  # only its surfaces failed
+                cached_record.update(error=error, fingerprint=None)
+                records.append(cached_record)
+            else:
+                records.append({'las_path': str(las_path), 'error': error})
+
+        for las_path, tile_result, error in tqdm(self.imap_tiles(run_qaqc_tile, iter_tasks()), 
+                                                 ascii=True):
+            if tile_result is None:
+                add_error(las_path, error)
+                continue
+
+            # the surfaces that failed are retried (and the tile is 
+            # quarantined if they fail every attempt), but its check 
+            # results are kept
+            record, timings, surfaces, surface_error = tile_result
+            for stype, tif_path in surfaces.items():
+                if tif_path is not None:
+                    tile_surfaces[(stype, str(las_path))] = tif_path
+
+            # the timings are stored with the tile's results, which are 
+            # rewritten even if only its surfaces were made this time
+            tile_timings[str(las_path)] = timings
+            bytes_read = sum(t['bytes'] for t in timings.values())
+            if record is None:
+                record = tile_records.get(str(las_path))
+            if record is not None:
+                fingerprint = None if surface_error else fingerprints.get(record['las_path'])
+                record.update(fingerprint=fingerprint, error=surface_error, 
+                              timings=timings, bytes_read=bytes_read)
+                tile_records[record['las_path']] = record
+                records.append(record)
+
+            if error is not None:
+                logging.error(f'{las_path} is quarantined: {error}')
+                quarantine.append({'las_path': str(las_path), 'error': error})
+            elif surface_error is None:
+                passed.append(str(las_path))
+                journal.add_tile(las_path, tile_records.get(str(las_path)), surfaces)
+
+            if len(records) >= self.config.results_batch_size:
+                tic = time.perf_counter()
+                store.insert(records)
+                journal.sync()
+                store_time += time.perf_counter() - tic
+                records = []
+        # the tiles that couldn't even be fingerprinted
+        for las_path, error in discovery_errors:
+            add_error(las_path, error)
+
+        tic = time.perf_counter()
+        store.insert(records)
+        store.insert(journaled_records)
+        journal.sync()
+        store_time += time.perf_counter() - tic
+        self.log_timings(tile_timings, store_time)
+        logging.info(f'{num_cached} unchanged tiles used cached results')
+        logging.info(f'{len(journaled_records)} tiles were already done before the run was resumed')
+        self.quarantine = quarantine
+        self.write_quarantine(quarantine, passed, update)
+        return tile_records, tile_surfaces
 
+    @staticmethod
+    def log_timings(tile_timings, store_time, num_slowest=5):
+        if not tile_timings:
+            return
+        stage_totals = {}
+        for timings in tile_timings.values():
+            for stage, timing in timings.items():
+                totals = stage_totals.setdefault(stage, {'wall': 0.0, 'cpu': 0.0, 'bytes': 0})
+                for k in totals:
+                    totals[k] += timing[k]
+
+        total_wall = sum(t['wall'] for t in stage_totals.values())
+        logging.info(f'time spent in each stage, over {len(tile_timings)} tiles:')
+        for stage, totals in sorted(stage_totals.items(), key=lambda kv: -kv[1]['wall']):
+            logging.info(f"  {stage}: {totals['wall']:.1f} s wall "
+                         f"({100 * totals['wall'] / max(total_wall, 1e-9):.0f}%), "
+                         f"{totals['cpu']:.1f} s cpu, {totals['bytes'] / 1024 ** 2:.1f} MB read")
+        logging.info(f'  writing results (in the parent): {store_time:.1f} s wall')
+
+        tile_walls = {k: sum(t['wall'] for t in v.values()) for k, v in tile_timings.items()}
+        p50, p90, p99 = np.percentile(list(tile_walls.values()), [50, 90, 99])
+        logging.info(f'time per tile: {p50:.2f} s median, {p90:.2f} s 90th percentile, '
+                     f'{p99:.2f} s 99th percentile')
+        logging.info('slowest tiles:')
+        for las_path in sorted(tile_walls, key=tile_walls.get, reverse=True)[:num_slowest]:
+            timings = tile_timings[las_path]
+            slowest_stage = max(timings, key=lambda stage: timings[stage]['wall'])
+            logging.info(f'  {las_path}: {tile_walls[las_path]:.2f} s '
+                         f'(mostly {slowest_stage}, {timings[slowest_stage]["wall"]:.2f} s)')
+
+    def write_quarantine(self, quarantine, passed=(), update=False):
+        # rewritten every run, so it only lists the tiles that failed this 
+        # time, unless it's updated with a batch of tiles
+        listed = quarantine
+        if update and self.config.quarantine_json.exists():
+            with open(self.config.quarantine_json) as f:
+                earlier = json.load(f)
+            done = set(passed) | set(e['las_path'] for e in quarantine)
+            listed = [e for e in earlier if e['las_path'] not in done] + quarantine
+        with open(self.config.quarantine_json, 'w') as f:
+            json.dump(listed, f, indent=2)
+        if quarantine:
+            logging.warning(f'{len(quarantine)} tiles failed and were quarantined '
+                            f'(see {self.config.quarantine_json})')
+
+    def get_tile_size(self, task):
+        las_path = str(task[0])
+        if las_path not in self.tile_sizes:
+            self.tile_sizes[las_path] = os.path.getsize(las_path)
+        return self.tile_sizes[las_path]
+
+    def order_tiles(self, tasks):
+        # largest first, so a few huge tiles don't start last and leave
+        # one worker grinding while the rest idle
+        return sorted(tasks, key=self.get_tile_size, reverse=True)
 
-class QaqcTileCollection:
+    @staticmethod
+    def simulate_makespan(task_times, num_workers):
+        # each task goes to the worker that frees up first, as in the pool
+        workers = [0.0] * num_workers
+        for task_time in task_times:
+            heapq.heappush(workers, heapq.heappop(workers) + task_time)
+        return max(workers)
+
+    def log_makespan(self, listed_tasks, ordered_tasks, task_times, makespan):
+        num_workers = self.config.num_workers if self.config.multiprocess else 1
+        expected = self.simulate_makespan(
+            [task_times[t[0]] for t in ordered_tasks if t[0] in task_times], num_workers)
+        unordered = self.simulate_makespan(
+            [task_times[t[0]] for t in listed_tasks if t[0] in task_times], num_workers)
+        lower_bound = max(sum(task_times.values()) / num_workers, 
+                          max(task_times.values(), default=0))
+        logging.info(f'makespan: {makespan:.1f} s actual, {expected:.1f} s expected '
+                     f'(largest first), {unordered:.1f} s expected in listed order, '
+                     f'{lower_bound:.1f} s lower bound')
+
+    def get_tile_surface_path(self, stype, surface_name):
+        surface_dir = self.config.surfaces_to_make[self.config.surface_outputs[stype][0]][1]
+        return Path(surface_dir) / f'{surface_name}_{stype}.tif'
+
+    def get_tile_surfaces(self, las_path):
+        # the surfaces the tile has in the surface dirs
+        surface_name = LasTile.get_surface_name(las_path, self.config.las_tile_dir)
+        tile_surfaces = {}
+        for name in self.surface_outputs:
+            tif_path = self.get_tile_surface_path(name, surface_name)
+            if tif_path.exists():
+                tile_surfaces[(name, las_path)] = str(tif_path)
+        return tile_surfaces
 
-    def __init__(self, las_paths, config,):
-        self.las_paths = las_paths
+    def write_tile_surface(self, stype, surface_name, tile_surface):
+        # the raster goes to the surface dir, and only its path goes back to 
+        # the parent (or across the work queue)
+        tif_path = self.get_tile_surface_path(stype, surface_name)
+        if tile_surface is None:  # e.g., no ground or bathy points
+            if tif_path.exists():  # made from an earlier delivery of the tile
+                os.remove(tif_path)
+            return None
+        profile, data = tile_surface
+        profile = dict(profile, driver='GTiff')
+        with rasterio.open(tif_path, 'w', **profile) as dst:
+            dst.write(data)
+        return str(tif_path)
+
+    def map_tasks(self, timed_func, tasks, chunksize=None, work_queue=None):
+        if work_queue is not None:
+            return work_queue.imap(tasks, self.get_tile_size)
+        elif self.config.multiprocess and self.config.num_workers > 1:
+            scheduler = TileScheduler(
+                self.config, self.estimate_task_memory, self.get_tile_size, chunksize)
+            return scheduler.imap(timed_func, tasks)
+        else:  # serial mode, e.g., for debugging
+            set_worker_qaqc(self)
+            return map(timed_func, tasks)
+
+    def imap_tiles(self, func, tasks):
+        # tasks can be a generator (e.g., of tiles as they're discovered) of
+        # tuples that start with the tile's path; yields each tile's result, 
+        # or its error if it failed every attempt
+        listed_tasks = []
+
+        def iter_listed():
+            for task in tasks:
+                listed_tasks.append(task)
+                yield task
+
+        timed_func = partial(run_timed_task, func)
+        task_times = {}
+        tic = time.time()
+
+        work_queue = None
+        if self.config.distributed:
+            work_queue = WorkQueue(self.config)
+            work_queue.start()
+
+        # failed tiles are retried once the others are done, one tile per 
+        # job, so a bad tile can't fail the ones chunked with it again; a 
+        # tile whose checks ran but whose surfaces failed is yielded with 
+        # its surface error (the last item of its result), and only its 
+        # surfaces are retried
+        try:
+            retry_tasks = iter_listed()
+            surfaces_only = set()
+            for attempt in range(self.config.max_retries + 1):
+                if attempt:
+                    logging.info(f'retrying {len(retry_tasks)} failed tiles (attempt {attempt + 1})')
+                failed = set()
+                chunksize = 1 if attempt else None
+                for las_path, task_time, result, error in self.map_tasks(
+                        timed_func, retry_tasks, chunksize, work_queue):
+                    task_times[las_path] = task_time
+                    surface_error = result[-1] if error is None else None
+                    if error is None and surface_error is None:
+                        yield las_path, result, None
+                    elif attempt < self.config.max_retries:
+                        logging.warning(f'{las_path} failed: {error or surface_error}')
+                        failed.add(str(las_path))
+                        if error is None:
+                            surfaces_only.add(str(las_path))
+                            yield las_path, result, None
+                    else:
+                        yield las_path, result, error or surface_error
+                retry_tasks = [(task[0], False) if str(task[0]) in surfaces_only else task 
+                               for task in listed_tasks if str(task[0]) in failed]
+                if not retry_tasks:
+                    break
+        finally:
+            if work_queue is not None:
+                work_queue.stop()
+
+        self.log_makespan(listed_tasks, self.order_tiles(listed_tasks), 
+                          task_times, time.time() - tic)
+
+    def estimate_task_memory(self, task):
+        las_path, run_checks = task
+        las_header = LasHeader(las_path)
+        memory = 0
+
+        # the point scan and the PDAL surface pipelines hold the point records; 
+        # LAZ is decompressed into PDAL arrays (whole for the PDAL surface 
+        # pipelines, else a chunk at a time), which are wider than its records
+        if self.needs_points(run_checks) or self.surface_types:
+            num_points = las_header.num_points
+            record_length = las_header.get_header_property('data_record_length')
+            if las_header.is_compressed:
+                pdal_surfaces = [s for s in self.surface_types if s not in self.get_gridded_surfaces()]
+                if not pdal_surfaces:
+                    num_points = min(num_points, self.config.point_chunk_size)
+                record_length += self.get_pdal_point_size(las_header)
+            memory += num_points * record_length
+
+        if self.surface_types:
+            x_range = las_header.get_header_property('x_max') - las_header.get_header_property('x_min')
+            y_range = las_header.get_header_property('y_max') - las_header.get_header_property('y_min')
+            for stype in self.surface_types:
+                resolution = self.config.surface_outputs[stype][1]
+                num_cells = (int(x_range / resolution) + 1) * (int(y_range / resolution) + 1)
+                if stype in self.get_gridded_surfaces():
+                    memory += num_cells * self.surface_accumulators[stype].bytes_per_cell
+                else:
+                    memory += num_cells * self.raster_bytes_per_cell
+
+        return memory
+
+
+    def get_pdal_point_size(self, las_header):
+        # the itemsize of the arrays PDAL reads the tile into, from a read 
+        # of its first point; it only depends on the point format
+        key = (las_header.get_header_property('data_format_id'), 
+               las_header.get_header_property('data_record_length'))
+        if key not in self.pdal_point_sizes:
+            pipeline = pdal.Pipeline(json.dumps({'pipeline': [
+                {'type': 'readers.las', 'filename': str(las_header.path), 'count': 1}]}))
+            pipeline.execute()
+            self.pdal_point_sizes[key] = pipeline.arrays[0].itemsize
+        return self.pdal_point_sizes[key]
+
+
+class TileScheduler:
+
+    def __init__(self, config, estimate_memory, get_size, chunksize=None):
         self.config = config
-        self.qaqc_results_df = None
+        self.num_workers = self.config.num_workers
+        self.chunksize = chunksize or self.config.chunksize
+        self.estimate_memory = estimate_memory
+        self.get_size = get_size
+        self.task_ids = itertools.count()
+        if self.config.ram_budget_gb:
+            self.ram_budget = self.config.ram_budget_gb * 1024 ** 3
+        else:
+            self.ram_budget = None
+
+    def discover(self, tasks, events):
+        # runs in a thread, so the pool is kept busy with the tiles found so 
+        # far while a slow share is still being listed
+        try:
+            for task in tasks:
+                try:
+                    memory = 0 if self.ram_budget is None else self.estimate_memory(task)
+                except Exception as e:  # e.g., the tile's header is bad
+                    logging.exception(e)
+                    events.put(('failed', (task[0], 0.0, None, repr(e))))
+                    continue
+                events.put(('task', (-self.get_size(task), next(self.task_ids), task, memory)))
+            events.put(('discovered', None))
+        except Exception as e:
+            events.put(('discovered', e))
+
+    def next_job(self, pending, in_flight_memory, num_in_flight):
+        # pending is a heap with the largest task on top, so the largest 
+        # task that fits the remaining budget is the first one that fits; 
+        # the ones that didn't fit are put back
+        job = []
+        skipped = []
+        job_memory = 0
+        while pending and len(job) < self.chunksize:
+            item = heapq.heappop(pending)
+            _, _, task, memory = item
+            if self.ram_budget is None:
+                fits = True
+            else:
+                fits = in_flight_memory + job_memory + memory <= self.ram_budget
+
+            # a task bigger than the whole budget runs on its own
+            if fits or (not num_in_flight and not job):
+                if not fits:
+                    logging.warning(f'{task[0]} is estimated to need more than the RAM budget')
+                job.append(item)
+                job_memory += memory
+            else:
+                skipped.append(item)
+        for item in skipped:
+            heapq.heappush(pending, item)
+        return job
+
+    def start_pool(self):
+        # the configuration is shipped to each worker once, by the pool
+        # initializer, rather than pickled with every task
+        return mp.Pool(processes=self.num_workers, 
+                       initializer=init_worker, 
+                       initargs=(self.config,), 
+                       maxtasksperchild=self.config.maxtasksperchild)
+
+    def get_timed_out(self, in_flight):
+        # a job is given the timeout for each of its tiles
+        if not self.config.task_timeout:
+            return []
+        now = time.time()
+        return [job_id for job_id, (job, start) in in_flight.items() 
+                if now - start > self.config.task_timeout * len(job)]
+
+    def imap(self, func, tasks):
+        events = queue.Queue()
+        discovery = threading.Thread(target=self.discover, args=(tasks, events), daemon=True)
+        discovery.start()
+        discovering = True
+        pending = []
+        in_flight = {}
+        job_ids = itertools.count()
+
+        # with a timeout, wake up now and then to look for hung jobs
+        if self.config.task_timeout:
+            poll_interval = min(self.config.task_timeout, 5.0)
+        else:
+            poll_interval = None
+
+        p = self.start_pool()
+        try:
+            while discovering or pending or in_flight:
+                while pending and len(in_flight) < self.num_workers:
+                    in_flight_memory = sum(item[-1] for job, _ in in_flight.values() for item in job)
+                    job = self.next_job(pending, in_flight_memory, len(in_flight))
+                    if not job:
+                        break
+                    job_id = next(job_ids)
+                    in_flight[job_id] = (job, time.time())
+                    p.apply_async(
+                        run_task_chunk, (func, [task for _, _, task, _ in job]), 
+                        callback=lambda r, j=job_id: events.put(('done', (j, r, None))), 
+                        error_callback=lambda e, j=job_id: events.put(('done', (j, None, e))))
+
+                try:
+                    event, value = events.get(timeout=poll_interval)
+                except queue.Empty:
+                    event = value = None
+
+                if event == 'task':
+                    heapq.heappush(pending, value)
+                elif event == 'failed':
+                    yield value
+                elif event == 'discovered':
+                    discovering = False
+                    if value is not None:
+                        raise value
+                elif event == 'done':
+                    job_id, job_results, error = value
+                    if job_id in in_flight:  # else it finished as its pool was replaced
+                        job, _ = in_flight.pop(job_id)
+                        if error is not None:  # e.g., the tasks couldn't be pickled
+                            job_results = [(task[0], 0.0, None, repr(error)) for _, _, task, _ in job]
+                        for result in job_results:
+                            yield result
+
+                timed_out = self.get_timed_out(in_flight)
+                if timed_out:
+                    # a hung (or killed) worker can't be stopped on its own, so 
+                    # the pool is replaced, and the other jobs that were in 
+                    # flight are put back to run first, without counting 
+                    # against their tiles
+                    p.terminate()
+                    p.join()
+                    failed = []
+                    for job_id, (job, start) in in_flight.items():
+                        if job_id in timed_out:
+                            task_time = time.time() - start
+                            failed.extend((task[0], task_time, None, 
+                                           f'timed out after {task_time:.0f} s') for _, _, task, _ in job)
+                        else:
+                            for item in job:
+                                heapq.heappush(pending, item)
+                    in_flight.clear()
+                    logging.warning(f'{len(failed)} tiles timed out; restarting the worker pool')
+                    p = self.start_pool()
+                    for result in failed:
+                        yield result
+            p.close()
+        finally:
+            p.terminate()
+            p.join()
+
+
+class RunJournal:
+
+    # an append-only log of finished tiles and stages, for --resume
+
+    def __init__(self, config, resume=False, journal_path=None):
+        self.journal_path = journal_path or config.run_journal
+        self.tiles = {}
+        self.stages = {}
+        self.cut_off = False
+        if resume:
+            self.load()
+        self.journal = open(self.journal_path, 'a' if resume else 'w')
+        if self.cut_off:
+            self.journal.write('\n')
+
+    def load(self):
+        try:
+            with open(self.journal_path) as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            logging.info(f'{self.journal_path} doesn\'t exist; starting from the beginning')
+            return
+
+        self.cut_off = bool(lines) and not lines[-1].endswith('\n')
+        for line in lines:
+            try:
+                entry = json.loads(line)
+            except ValueError:  # the last line is cut off if the run died mid-write
+                continue
+            if entry['type'] == 'tile':
+                self.tiles[entry['las_path']] = entry
+            elif entry['type'] == 'stage':
+                self.stages[entry['stage']] = entry
+
+    def write(self, entry):
+        self.journal.write(json.dumps(entry) + '\n')
+        self.journal.flush()
+
+    def sync(self):
+        os.fsync(self.journal.fileno())
+
+    def add_tile(self, las_path, record, surfaces):
+        if record is None and str(las_path) in self.tiles:  # a surfaces-only visit
+            record = self.tiles[str(las_path)]['record']
+        entry = {'type': 'tile', 'las_path': str(las_path), 
+                 'record': record, 'surfaces': surfaces}
+        self.tiles[entry['las_path']] = entry
+        self.write(entry)
+
+    def add_stage(self, stage, output=None):
+        entry = {'type': 'stage', 'stage': stage, 
+                 'output': str(output) if output else None}
+        self.stages[stage] = entry
+        self.write(entry)
+        self.sync()
+
+    def is_stage_done(self, stage):
+        if stage in self.stages:
+            logging.info(f'{stage} was already done before the run was resumed')
+            return True
+        return False
+
+    def close(self):
+        self.journal.close()
+
+
+class WorkQueue:
+
+    # tasks are files in a directory on the project share: they're claimed by 
+    # renaming them from pending/ to claimed/ (atomic, so only one worker 
+    # wins), and results are written to done/ for the parent to collect
+
+    def __init__(self, config):
+        self.config = config
+        self.queue_dir = self.config.work_queue_dir
+        self.pending_dir = self.queue_dir / 'pending'
+        self.claimed_dir = self.queue_dir / 'claimed'
+        self.done_dir = self.queue_dir / 'done'
+        self.closed_marker = self.queue_dir / 'closed'
+        self.worker_id = f'{socket.gethostname()}_{os.getpid()}'
+        self.workers = []  # the local ones
 
     @staticmethod
-    def create_src(v):
-        memfile = MemoryFile()
-        src = memfile.open(**v[0])
-        src.write(v[1])
-        return src
+    def write_json(json_path, data):
+        tmp_path = json_path.with_name(json_path.name + '.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, json_path)
+
+    def reset(self):
+        for d in (self.pending_dir, self.claimed_dir, self.done_dir):
+            if d.exists():
+                shutil.rmtree(d)
+            os.makedirs(d)
+        if self.closed_marker.exists():
+            os.remove(self.closed_marker)
+
+    def publish(self, tasks, get_size, published):
+        # runs in a thread, as tiles are discovered; workers claim in name 
+        # order, so the name starts with the inverted, zero-padded size to 
+        # put the largest of the tiles published so far first
+        try:
+            for i, task in enumerate(tasks):
+                las_path, run_checks = task
+                las_name = os.path.splitext(os.path.basename(las_path))[0]
+                size_key = 10 ** 15 - get_size(task)
+                task_json = self.pending_dir / f'{size_key:016d}_{i:08d}_{las_name}.json'
+                # announced before it's written, so its result can't beat it
+                published.put(('task', str(las_path)))
+                self.write_json(task_json, {'las_path': str(las_path), 'run_checks': run_checks})
+            published.put(('published', None))
+        except Exception as e:
+            published.put(('published', e))
 
-    def run_qaqc_tile_collection_checks(self):
-        tiles_qaqc = QaqcTile(self.config)
-        tiles_qaqc.run_qaqc_checks(self.las_paths)
+    def close(self):
+        self.closed_marker.touch()
 
-    def run_qaqc_tile_collection_surfaces(self, stype):
-        tiles_qaqc = QaqcTile(self.config)
-        tile_surfaces = tiles_qaqc.run_qaqc_surfaces(self.las_paths, stype)
-        return tile_surfaces
+    def is_closed(self):
+        return self.closed_marker.exists()
 
-    def gen_qaqc_results_dict(self):
-        def flatten_dict(d_obj):
-            for k, v in d_obj.items():
-                if isinstance(v, dict):
-                    new_dict = {k2:v2 for k2, v2 in v.items()}
-                    for d in flatten_dict(new_dict):
-                        yield d
-                else:
-                    yield k, v
+    def claim(self):
+        try:
+            task_names = sorted(n for n in os.listdir(self.pending_dir) if n.endswith('.json'))
+        except FileNotFoundError:
+            return None
 
-        flattened_dicts = []
-        for las_json in os.listdir(self.config.json_dir):
+        for task_name in task_names:
+            claimed_json = self.claimed_dir / f'{task_name[:-5]}.{self.worker_id}.json'
             try:
-                las_json = os.path.join(self.config.json_dir, las_json)
-                with open(las_json, 'r') as json_file:
-                    json_data = json.load(json_file)
-                    flattened_json_data = {k:v for k,v in flatten_dict(json_data)}
-                    flattened_dicts.append(flattened_json_data)
+                os.rename(self.pending_dir / task_name, claimed_json)
+            except OSError:  # another worker got there first
+                continue
+            os.utime(claimed_json)  # the claim's age is what times it out
+            with open(claimed_json) as f:
+                return claimed_json, json.load(f)
+        return None
+
+    def complete(self, claimed_json, result):
+        self.write_json(self.done_dir / claimed_json.name, result)
+        try:
+            os.remove(claimed_json)
+        except FileNotFoundError:  # it timed out, and the parent took it back
+            pass
+
+    def take_stale_claims(self):
+        # a claim older than the timeout belongs to a hung or dead worker
+        stale = []
+        if not self.config.task_timeout:
+            return stale
+        now = time.time()
+        for claimed_name in os.listdir(self.claimed_dir):
+            claimed_json = self.claimed_dir / claimed_name
+            try:
+                age = now - os.path.getmtime(claimed_json)
+                if age <= self.config.task_timeout:
+                    continue
+                with open(claimed_json) as f:
+                    task = json.load(f)
+                os.remove(claimed_json)
+            except (OSError, ValueError):  # completed in the meantime
+                continue
+            stale.append((task['las_path'], age))
+        return stale
+
+    def start_local_workers(self):
+        num_workers = self.config.num_workers if self.config.multiprocess else 1
+        workers = []
+        for _ in range(num_workers):
+            worker = mp.Process(target=run_qaqc_worker, args=(self.config.config_json,))
+            worker.start()
+            workers.append(worker)
+        return workers
+
+    def start(self):
+        # the queue is opened once for the run, and only closed after the 
+        # last retry pass, so the remote workers stay for the retries
+        self.reset()
+        self.workers = self.start_local_workers()
+
+    def stop(self):
+        self.close()
+        # local workers are only left running if they're stuck on a tile
+        for worker in self.workers:
+            worker.join(self.config.queue_poll_interval * 10)
+            if worker.is_alive():
+                worker.terminate()
+                worker.join()
+        self.workers = []
+
+    def imap(self, tasks, get_size):
+        published = queue.Queue()
+        publisher = threading.Thread(target=self.publish, args=(tasks, get_size, published), daemon=True)
+        publisher.start()
+        publishing = True
+        remaining = set()
+        while publishing or remaining:
+            while not published.empty():
+                event, value = published.get()
+                if event == 'task':
+                    remaining.add(value)
+                else:
+                    publishing = False
+                    if value is not None:
+                        raise value
+
+            result_names = [n for n in os.listdir(self.done_dir) if n.endswith('.json')]
+            if not result_names:
+                for las_path, age in self.take_stale_claims():
+                    if las_path in remaining:
+                        remaining.remove(las_path)
+                        yield las_path, age, None, f'timed out after {age:.0f} s'
+                time.sleep(self.config.queue_poll_interval)
+                continue
+
+            for result_name in result_names:
+                result_json = self.done_dir / result_name
+                with open(result_json) as f:
+                    result = json.load(f)
+                os.remove(result_json)
+                if result['las_path'] not in remaining:  # came in after it timed out
+                    continue
+                remaining.remove(result['las_path'])
+
+                if result['error']:
+                    error = '{} (on {})'.format(result['error'], result['worker'])
+                    yield result['las_path'], result['task_time'], None, error
+                    continue
+
+                tile_result = (result['record'], result['timings'], result['surfaces'], 
+                               result['surface_error'])
+                yield result['las_path'], result['task_time'], tile_result, None
+
+    def work(self, qaqc):
+        logging.info(f'{self.worker_id} is waiting for tiles in {self.queue_dir}')
+        while True:
+            claimed = self.claim()
+            if claimed is None:
+                if self.is_closed():
+                    break
+                time.sleep(self.config.queue_poll_interval)
+                continue
+
+            claimed_json, task = claimed
+            result = {
+                'las_path': task['las_path'], 
+                'worker': self.worker_id, 
+                'record': None, 
+                'timings': None, 
+                'surfaces': {}, 
+                'surface_error': None, 
+                'error': None,
+                }
+            tic = time.perf_counter()
+            try:
+                (result['record'], result['timings'], result['surfaces'], 
+                 result['surface_error']) = \
+                    qaqc.run_qaqc_tile_multiprocess((task['las_path'], task['run_checks']))
             except Exception as e:
-                logging.debug(e)
-        return flattened_dicts
+                logging.exception(e)
+                result['error'] = repr(e)
+            result['task_time'] = time.perf_counter() - tic
+            self.complete(claimed_json, result)
+
+
+worker_qaqc = None  # the QaqcTile of each pool worker, see init_worker
+
+
+def set_worker_qaqc(qaqc):
+    global worker_qaqc
+    worker_qaqc = qaqc
+
+
+def init_worker(config):
+    logging.basicConfig(format='%(asctime)s:%(message)s', 
+                        level=logging.WARNING)
+    set_worker_qaqc(QaqcTile(config))
+
+
+def run_timed_task(func, task):
+    # a failed tile is returned with its error, rather than raised, so it 
+    # doesn't take the rest of its chunk down with it
+    tic = time.perf_counter()
+    try:
+        result, error = func(task), None
+    except Exception as e:
+        logging.exception(e)
+        result, error = None, repr(e)
+    return task[0], time.perf_counter() - tic, result, error
+
+
+def run_task_chunk(func, tasks):
+    return [func(task) for task in tasks]
+
+
+def run_qaqc_tile(task):
+    return worker_qaqc.run_qaqc_tile_multiprocess(task)
+
+
+class QaqcTileCollection:
+
+    def __init__(self, las_tiles, config,):
+        self.las_tiles = las_tiles
+        self.config = config
+        self.qaqc_results_df = None
+        self.results_store = ResultsStore(self.config.results_db)
+        self.tile_records = {}
+        self.quarantine = []
+
+    def run_qaqc_tile_collection(self, journal, update=False):
+        tiles_qaqc = QaqcTile(self.config)
+        self.tile_records, tile_surfaces = tiles_qaqc.run_qaqc(
+            self.las_tiles, self.results_store, journal, update)
+        self.quarantine = tiles_qaqc.quarantine
+        return tile_surfaces
+
+    def get_tile_surfaces(self, las_paths):
+        tiles_qaqc = QaqcTile(self.config)
+        tile_surfaces = {}
+        for las_path in las_paths:
+            tile_surfaces.update(tiles_qaqc.get_tile_surfaces(las_path))
+        return tile_surfaces
 
     def get_unq_pt_src_ids(self):
         unq_pt_src_ids = set([])
@@ -1091,7 +3049,11 @@ class QaqcTileCollection:
         return unq_pt_src_ids
 
     def set_qaqc_results_df(self):
-        self.qaqc_results_df = pd.DataFrame(self.gen_qaqc_results_dict())
+        self.qaqc_results_df = pd.DataFrame(list(self.tile_records.values()))
+        # the stage timings go out as JSON text, as they're stored
+        if 'timings' in self.qaqc_results_df:
+            self.qaqc_results_df['timings'] = self.qaqc_results_df['timings'].apply(
+                lambda t: json.dumps(t) if isinstance(t, dict) else t)
     
     # todo: refactor these 3 into one maybe?
     def gen_qaqc_results_gdf_NAD83_UTM_CENTROIDS(self):
@@ -1177,14 +3139,15 @@ class QaqcTileCollection:
         gdf = gdf.drop(columns=['ExtentXMax','ExtentXMin', 'ExtentYMax', 
                                 'ExtentYMin', 'centroid_x', 'centroid_y', 
                                 'created_day', 'created_year', 'tile_polygon', 
-                                'x_max', 'x_min', 'y_max', 'y_min'])
+                                'x_max', 'x_min', 'y_max', 'y_min', 'fingerprint', 
+                                'timings'], errors='ignore')
 
         schema = gpd.io.file.infer_schema(gdf)
         gdf.to_file(output, driver='ESRI Shapefile', schema=schema)
 
-    def gen_mosaic(self, mtype, vrts):
+    def gen_mosaic(self, mtype, tif_paths):
         mosaic = Mosaic(mtype, self.config)
-        mosaic.gen_mosaic(vrts)
+        mosaic.gen_mosaic(tif_paths)
 
     def gen_tile_geojson_WGS84(shp, geojson):
         gdf = gpd.read_file(shp).to_crs(self.config.wgs84_epsg)
@@ -1219,43 +3182,130 @@ class QaqcTileCollection:
         gdf.to_file(geojson, driver="GeoJSON")
 
 
-def run_qaqc(config_json):
-    config = Configuration(config_json)
-    
-    logging.info('-' * 50)
-    logging.info('Ignore the following laspy-generated warning, which doesn\'t effect Q-Checker:')
-    logging.info('WARNING: Invalid body length for classification lookup, not parsing.')
-    logging.info('It has to do with the self.rec_len_after_header attribute of VLR record_id 0.')
-    logging.info('(self.rec_len_after_header % 16 != 0)')
-    logging.info('-' * 50)
-
-    qaqc_tile_collection = LasTileCollection(config.las_tile_dir)
-    qaqc = QaqcTileCollection(qaqc_tile_collection.get_las_tile_paths()[0:], config)
-
-    logging.info(config.checks_to_do)
+def gen_summary_outputs(config, qaqc, journal):
     if any(list(config.checks_to_do.values())):    
-        qaqc.run_qaqc_tile_collection_checks()
         qaqc.set_qaqc_results_df()
-        qaqc.gen_qaqc_shp_NAD83_UTM(config.qaqc_shp_NAD83_UTM_POLYGONS)
-        qaqc.gen_qaqc_json_WebMercator_CENTROIDS()
-        qaqc.gen_qaqc_json_WebMercator_POLYGONS()
-
-        dashboard = SummaryPlots(config, qaqc.qaqc_results_df)
-        dashboard.gen_dashboard()  
+        if not journal.is_stage_done('results_shp'):
+            qaqc.gen_qaqc_shp_NAD83_UTM(config.qaqc_shp_NAD83_UTM_POLYGONS)
+            journal.add_stage('results_shp', config.qaqc_shp_NAD83_UTM_POLYGONS)
+        if not journal.is_stage_done('results_geojson'):
+            qaqc.gen_qaqc_json_WebMercator_CENTROIDS()
+            qaqc.gen_qaqc_json_WebMercator_POLYGONS()
+            journal.add_stage('results_geojson', config.qaqc_geojson_WebMercator_POLYGONS)
+
+        if not journal.is_stage_done('dashboard'):
+            dashboard = SummaryPlots(config, qaqc.qaqc_results_df)
+            dashboard.gen_dashboard()  
+            journal.add_stage('dashboard')
     else:
         logging.info('no checks are selected')
 
-    # build the surfaces the user checked
+
+def gen_mosaics(config, qaqc, tile_surfaces, journal):
+    # mosaic the surfaces the user checked, at each resolution
     surface_types = [k for k, v in config.surfaces_to_make.items() if v[0]]
-    logging.info(surface_types)
-    for stype in surface_types:
+    surface_outputs = [k for k, v in config.surface_outputs.items() if v[0] in surface_types]
+    for stype in surface_outputs:
+        if journal.is_stage_done(f'{stype}_mosaic'):
+            continue
         logging.info(f'building {stype} mosaic...')
-        tile_surfaces = qaqc.run_qaqc_tile_collection_surfaces(stype)
-        vrts = [qaqc.create_src(v) for k, v in tile_surfaces.items()]
-        qaqc.gen_mosaic(stype, vrts)
+        tif_paths = [v for k, v in tile_surfaces.items() if k[0] == stype]
+        qaqc.gen_mosaic(stype, tif_paths)
+        journal.add_stage(f'{stype}_mosaic', Mosaic(stype, config).path)
+
+
+def run_qaqc(config_json, resume=False):
+    config = Configuration(config_json)
+    journal = RunJournal(config, resume)
+    
+    # tiles are handed to the workers as they're found
+    las_tile_collection = LasTileCollection(config.las_tile_dir, config.las_patterns)
+    qaqc = QaqcTileCollection(las_tile_collection.iter_las_tiles(), config)
+
+    # checks and surfaces are made in the same visit to each tile
+    surface_types = [k for k, v in config.surfaces_to_make.items() if v[0]]
+    logging.info(config.checks_to_do)
+    logging.info(surface_types)
+    tile_surfaces = qaqc.run_qaqc_tile_collection(journal)
 
+    gen_summary_outputs(config, qaqc, journal)
+    gen_mosaics(config, qaqc, tile_surfaces, journal)
+
+    journal.close()
+    qaqc.results_store.close()
     logging.info('YAY, you just QAQC\'d project {}!!!'.format(config.project_name).upper())
 
+
+def watch_qaqc(config_json):
+    # processes tiles as they're delivered, leaving the earlier ones alone
+    config = Configuration(config_json)
+    watcher = TileWatcher(config)
+    logging.info(f'watching {config.las_tile_dir} for new tiles (ctrl+c to stop)...')
+    while True:
+        las_tiles = watcher.poll()
+        if las_tiles:
+            logging.info(f'{len(las_tiles)} new or changed tiles')
+
+            # a journal of its own, so a run's journal is left for --resume
+            journal = RunJournal(config, resume=False, journal_path=config.watch_journal)
+            qaqc = QaqcTileCollection(las_tiles, config)
+            qaqc.run_qaqc_tile_collection(journal, update=True)
+
+            # the quarantined tiles are handed over again once they've 
+            # settled, like new ones
+            quarantined = set(e['las_path'] for e in qaqc.quarantine)
+            watcher.add_seen([t for t in las_tiles if str(t.path) not in quarantined])
+
+            # the summary outputs and mosaics cover every tile delivered so 
+            # far; the mosaics are rebuilt from the tiles' current surfaces, 
+            # so a re-delivered tile's old cells don't linger under its new ones
+            records = qaqc.results_store.get_records(watcher.seen)
+            qaqc.tile_records = {k: v for k, v in records.items() if 'tile_polygon' in v}
+            gen_summary_outputs(config, qaqc, journal)
+            gen_mosaics(config, qaqc, qaqc.get_tile_surfaces(watcher.seen), journal)
+            journal.close()
+            qaqc.results_store.close()
+            logging.info('waiting for more tiles...')
+        time.sleep(config.watch_interval)
+
+
+def run_qaqc_worker(config_json):
+    config = Configuration(config_json)
+    logging.basicConfig(format='%(asctime)s:%(message)s', 
+                        level=logging.INFO)
+    WorkQueue(config).work(QaqcTile(config))
+
     
 if __name__ == '__main__':
-    pass
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Q-Checker')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser(
+        'run', help='QAQC the project specified in a configuration file')
+    run_parser.add_argument('config_json')
+    run_parser.add_argument('--resume', action='store_true', 
+                            help='continue a run that died, skipping the tiles '
+                                 'and stages it had finished')
+
+    worker_parser = subparsers.add_parser(
+        'worker', help='process tiles from the work queue of a distributed run '
+                       '(start it after the run has started)')
+    worker_parser.add_argument('config_json')
+
+    watch_parser = subparsers.add_parser(
+        'watch', help='QAQC tiles as they are delivered to the las tile directory')
+    watch_parser.add_argument('config_json')
+
+    args = parser.parse_args()
+    if args.command == 'run':
+        logging.basicConfig(format='%(asctime)s:%(message)s', 
+                            level=logging.INFO)
+        run_qaqc(args.config_json, resume=args.resume)
+    elif args.command == 'worker':
+        run_qaqc_worker(args.config_json)
+    elif args.command == 'watch':
+        logging.basicConfig(format='%(asctime)s:%(message)s', 
+                            level=logging.INFO)
+        watch_qaqc(args.config_json)
@@ -599,7 +599,6 @@ class MainGuiPage(ttk.Frame):
                 qaqc_dir / 'dz',
                 qaqc_dir / 'dem',
                 qaqc_dir / 'tile_results',
-                qaqc_dir / 'tile_results' / 'json',
                 ]
 
             for d in dirs:
@@ -637,7 +636,6 @@ if __name__ == '__main__':
     mp.freeze_support()
 
     queue = mp.Manager().Queue(-1)
-    shared_dict = mp.Manager().dict()
     listener = mp.Process(target=listener_process, args=(queue,))
     listener.start()
     root_configurer(queue)